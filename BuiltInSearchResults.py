@@ -8,13 +8,23 @@ SearchResults.registerResultProvider('refreshTools',
                                      getItemGroupsUncached = lambda: [])
 SearchResults.registerResultProvider('document',
                                      getItemGroupsCached   = lambda: [],
-                                     getItemGroupsUncached = lambda: __import__('ResultsDocument').documentResultsProvider())
+                                     getItemGroupsUncached = lambda: __import__('ResultsDocument').documentResultsProvider(),
+                                     getUncachedVersion    = lambda: __import__('ResultsDocument').documentResultsVersion())
 SearchResults.registerResultProvider('toolbar',
                                      getItemGroupsCached   = lambda: __import__('ResultsToolbar').toolbarResultsProvider(),
                                      getItemGroupsUncached = lambda: [])
+SearchResults.registerCachedPerWorkbench('toolbar',
+                                         getItemGroupsForWorkbench = lambda wbname:        __import__('ResultsToolbar').workbenchToolbarResultsProvider(wbname),
+                                         mergeItemGroups           = lambda itemGroupsList: __import__('ResultsToolbar').mergeWorkbenchToolbarResults(itemGroupsList))
 SearchResults.registerResultProvider('param',
                                      getItemGroupsCached   = lambda: __import__('ResultsPreferences').paramResultsProvider(),
-                                     getItemGroupsUncached = lambda: [])
+                                     getItemGroupsUncached = lambda: [],
+                                     getCachedStamp        = lambda: __import__('ResultsPreferences').paramStamp())
+SearchResults.registerQueryResultProvider('files',
+                                          getItemGroupsForQuery = lambda query, limit: __import__('ResultsFiles').filesResultsForQuery(query, limit))
+SearchResults.registerResultProvider('diagnostics',
+                                     getItemGroupsCached   = lambda: [],
+                                     getItemGroupsUncached = lambda: __import__('ResultsDiagnostics').diagnosticsResultsProvider())
 
 SearchResults.registerResultHandler('refreshTools',
                                     action  = lambda nfo:            __import__('ResultsRefreshTools').refreshToolsAction(nfo),
@@ -34,9 +44,18 @@ SearchResults.registerResultHandler('document',
 SearchResults.registerResultHandler('documentObject',
                                     action  = lambda nfo           : __import__('ResultsDocument').documentObjectAction(nfo),
                                     toolTip = lambda nfo, setParent: __import__('ResultsDocument').documentObjectToolTip(nfo, setParent))
+SearchResults.registerResultHandler('file',
+                                    action  = lambda nfo           : __import__('ResultsFiles').fileAction(nfo),
+                                    toolTip = lambda nfo, setParent: __import__('ResultsFiles').fileToolTip(nfo, setParent))
+SearchResults.registerResultHandler('fileObject',
+                                    action  = lambda nfo           : __import__('ResultsFiles').fileObjectAction(nfo),
+                                    toolTip = lambda nfo, setParent: __import__('ResultsFiles').fileObjectToolTip(nfo, setParent))
 SearchResults.registerResultHandler('param',
                                     action  = lambda nfo           : __import__('ResultsPreferences').paramAction(nfo),
                                     toolTip = lambda nfo, setParent: __import__('ResultsPreferences').paramToolTip(nfo, setParent))
 SearchResults.registerResultHandler('paramGroup',
                                     action  = lambda nfo           : __import__('ResultsPreferences').paramGroupAction(nfo),
                                     toolTip = lambda nfo, setParent: __import__('ResultsPreferences').paramGroupToolTip(nfo, setParent))
+SearchResults.registerResultHandler('diagnostics',
+                                    action  = lambda nfo           : __import__('ResultsDiagnostics').diagnosticsAction(nfo),
+                                    toolTip = lambda nfo, setParent: __import__('ResultsDiagnostics').diagnosticsToolTip(nfo, setParent))
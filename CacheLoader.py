@@ -0,0 +1,118 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from PySide import QtCore
+
+# Reads the cache shards, decodes the first icons and indexes their trigrams and fields on a pool of worker threads, so that the search box
+# stays responsive while the cache is loading. The item groups of each shard are handed to the GUI
+# thread once the worker is done with them (the progress signal is emitted), and the stale shards are
+# harvested on the GUI thread once all the others have been read (the finished signal is emitted).
+class CacheLoader(QtCore.QObject):
+  shardRead = QtCore.Signal(object, object) # shardName, [itemGroup] or Exception; emitted from a worker thread
+  progress = QtCore.Signal()
+  finished = QtCore.Signal()
+
+  def __init__(self):
+    super(CacheLoader, self).__init__()
+    self.executor = ThreadPoolExecutor(max_workers = min(4, os.cpu_count() or 1))
+    self.pendingShards = set()
+    self.readShards = {}
+    self.itemGroups = None
+    # The icons are decoded in advance for at most as many icons as the LRU of decoded icons can hold,
+    # the others are decoded by the GUI thread when they are displayed (see IconCache.getIcon).
+    self.iconsToDecode = 0
+    self.iconsLock = threading.Lock()
+    self.shardRead.connect(self.onShardRead) # Queued connection, since the signal is emitted from another thread
+
+  def start(self):
+    # Gather the list of shards on the GUI thread, it uses the FreeCAD API.
+    import FreeCAD as App
+    import RefreshTools
+    import time
+    import IconCache
+    self.startTime = time.perf_counter()
+    self.iconsToDecode = IconCache.maxDecodedIcons
+    self.useTrigrams = App.ParamGet('User parameter:BaseApp/Preferences/Mod/SearchBar').GetBool('TrigramIndex', True)
+    self.useFields = App.ParamGet('User parameter:BaseApp/Preferences/Mod/SearchBar').GetBool('FieldIndex', True)
+    self.shards = RefreshTools.validShards()
+    self.pendingShards = set(shardName for shardName, providerName, wbname, stamp in self.shards)
+    if len(self.pendingShards) == 0:
+      self.finish()
+    for shardName, providerName, wbname, stamp in self.shards:
+      self.executor.submit(self.readShard, shardName, RefreshTools.shardPath(shardName))
+
+  # The itemGroups are only handed to the GUI thread once they are complete, so that the GUI thread
+  # (e.g. when merging the shards) never reads them while they are modified here.
+  def readShard(self, shardName, path):
+    import Serialize
+    try:
+      itemGroups = Serialize.deserializeFile(path)
+    except Exception as e:
+      itemGroups = e
+    if not isinstance(itemGroups, Exception):
+      try:
+        self.decodeIcons(itemGroups)
+        if self.useTrigrams:
+          import TrigramIndex
+          TrigramIndex.indexItemGroups(itemGroups)
+        if self.useFields:
+          import FieldIndex
+          FieldIndex.indexItemGroups(itemGroups)
+      except Exception as e:
+        # The shard is still usable, what is missing is computed on the GUI thread when needed
+        print('SearchBox: could not index cache shard ' + shardName + ' (' + str(e) + ')')
+    self.shardRead.emit(shardName, itemGroups)
+
+  # Decodes the icons of the top-level itemGroups, which are displayed first, within the budget shared by the shards.
+  def decodeIcons(self, itemGroups):
+    import IconCache
+    for itemGroup in itemGroups:
+      icon = itemGroup['icon']
+      if isinstance(icon, IconCache.IconHandle) and icon.iconId not in IconCache.decodedIcons:
+        with self.iconsLock:
+          if self.iconsToDecode <= 0:
+            return
+          self.iconsToDecode -= 1
+        icon.decodeImages()
+
+  def onShardRead(self, shardName, itemGroups):
+    self.readShards[shardName] = itemGroups
+    self.pendingShards.discard(shardName)
+    if len(self.pendingShards) == 0:
+      self.finish()
+    else:
+      self.progress.emit()
+
+  def partialItemGroups(self):
+    import RefreshTools
+    shardsOfProvider = {}
+    for shardName, providerName, wbname, stamp in self.shards:
+      itemGroups = self.readShards.get(shardName)
+      if itemGroups is not None and not isinstance(itemGroups, Exception):
+        shardsOfProvider.setdefault(providerName, []).append(itemGroups)
+    return RefreshTools.mergeShards(shardsOfProvider)
+
+  def finish(self):
+    import RefreshTools
+    import Instrumentation
+    import time
+    nbShards = len(self.readShards)
+    self.itemGroups = RefreshTools.refreshCache(readShards = self.readShards)
+    Instrumentation.record('cache/load', time.perf_counter() - self.startTime, nbShards)
+    self.readShards = {}
+    self.finished.emit()
+    self.progress.emit()
+
+  def isFinished(self):
+    return self.itemGroups is not None
+
+loader = None
+
+def start():
+  global loader
+  if loader is None:
+    # Make sure the result providers are registered before listing the shards.
+    import BuiltInSearchResults
+    loader = CacheLoader()
+    loader.start()
+  return loader
@@ -0,0 +1,50 @@
+import os
+import zipfile
+from xml.etree import ElementTree
+
+# Reads the objects of a closed .FCStd file from the Document.xml in the archive, without FreeCAD.
+# This module only uses the standard library: it is imported by the worker processes of FileIndex.
+
+# Returns { 'mtime', 'size', 'label', 'objects': [[name, label, typeId]] } for the file at path.
+# The XML is parsed as a stream, each element is discarded once it has been read.
+def readDocument(path):
+  result = { 'mtime': None, 'size': None, 'label': None, 'objects': [] }
+  objects = {} # name -> [name, label, typeId]
+  try:
+    stat = os.stat(path) # the file may have been removed since it was listed
+    result['mtime'] = stat.st_mtime_ns
+    result['size'] = stat.st_size
+    with zipfile.ZipFile(path) as archive:
+      with archive.open('Document.xml') as f:
+        stack = []
+        propertyName = None
+        objectName = None
+        for event, elem in ElementTree.iterparse(f, events = ('start', 'end')):
+          if event == 'start':
+            parent = stack[-1] if len(stack) > 0 else None
+            stack.append(elem.tag)
+            if elem.tag == 'Object' and parent == 'Objects':
+              name = elem.get('name')
+              objects[name] = [name, name, elem.get('type', '')]
+              result['objects'].append(objects[name])
+            elif elem.tag == 'Object' and parent == 'ObjectData':
+              objectName = elem.get('name')
+            elif elem.tag == 'Property':
+              propertyName = elem.get('name')
+            elif elem.tag == 'String' and parent == 'Property' and propertyName == 'Label':
+              # Document/Properties/Property/String, or Document/ObjectData/Object/Properties/Property/String
+              if len(stack) == 4:
+                result['label'] = elem.get('value')
+              elif objectName in objects:
+                objects[objectName][1] = elem.get('value')
+          else:
+            stack.pop()
+            if elem.tag == 'Property':
+              propertyName = None
+            elif elem.tag == 'Object':
+              objectName = None
+            elem.clear()
+  except Exception as e:
+    # Remembered until the file changes, so that it is not read again on each scan
+    result['error'] = str(e)
+  return result
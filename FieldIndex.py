@@ -0,0 +1,104 @@
+import html
+import re
+from bisect import bisect_left
+import SearchIndex
+
+# Index of the words of the other fields of the itemGroups (tooltips, workbenches, parameter paths and values),
+# so that e.g. a tool can be found by a word of its tooltip, without scanning the (long) tooltips on each keystroke.
+# Each word of the query must be the prefix of a word of one of these fields.
+# As with TrigramIndex, the index is computed for the subtree of each top-level itemGroup and stored in it,
+# it is therefore built once per generation of the cached results, by the CacheLoader's worker threads.
+
+# An itemGroup found only through these fields ranks after all the itemGroups whose text matches,
+# a word found in a field with a higher weight ranks higher.
+fieldScoreBase = -1000
+minQueryLength = 3
+
+def toolTipText(group):
+  toolTip = group['toolTip']
+  if isinstance(toolTip, dict):
+    return ' '.join(str(value) for value in toolTip.values())
+  if not isinstance(toolTip, str):
+    return ''
+  return html.unescape(re.sub('<[^>]*>', ' ', toolTip))
+
+def workbenchesText(group):
+  return ' '.join(group['action'].get('workbenches', []))
+
+def paramPathText(group):
+  if group['action'].get('handler') in ('param', 'paramGroup'):
+    return group['action'].get('path', '')
+  return ''
+
+def paramValueText(group):
+  if group['action'].get('handler') == 'param' and 'value' in group['action']:
+    return str(group['action']['value'])
+  return ''
+
+# (name, weight, text of the field of an itemGroup)
+fields = [
+  ('toolTip', 1, toolTipText),
+  ('workbenches', 2, workbenchesText),
+  ('paramPath', 1, paramPathText),
+  ('paramValue', 3, paramValueText),
+]
+
+def words(text):
+  return re.findall(r'\w+', SearchIndex.fold(text))
+
+# Sorted words of the subtree of a top-level itemGroup, and for each word a dict from
+# the offset of the itemGroups containing it (relative to the top-level one, in pre-order) to the highest weight.
+def getWords(group):
+  index = group.get('fields')
+  if index is None:
+    postings = {}
+    offset = 0
+    stack = [group]
+    while len(stack) > 0:
+      g = stack.pop()
+      for name, weight, getText in fields:
+        try:
+          text = getText(g)
+        except:
+          continue
+        for word in words(text):
+          posting = postings.setdefault(word, {})
+          if posting.get(offset, 0) < weight:
+            posting[offset] = weight
+      offset += 1
+      stack.extend(reversed(g['subitems']))
+    sortedWords = sorted(postings)
+    index = (sortedWords, [postings[word] for word in sortedWords])
+    group['fields'] = index
+  return index
+
+def indexItemGroups(itemGroups):
+  for group in itemGroups:
+    getWords(group)
+
+# Indices in the SearchIndex of the itemGroups whose fields match the folded query, and their scores, as a dict.
+def matches(searchIndex, q):
+  queryWords = words(q)
+  if len(q) < minQueryLength or len(queryWords) == 0:
+    return {}
+  result = {}
+  for base, group in searchIndex.topLevel:
+    sortedWords, postings = getWords(group)
+    scores = None
+    for queryWord in queryWords:
+      wordScores = {}
+      i = bisect_left(sortedWords, queryWord)
+      while i < len(sortedWords) and sortedWords[i].startswith(queryWord):
+        for offset, weight in postings[i].items():
+          if wordScores.get(offset, 0) < weight:
+            wordScores[offset] = weight
+        i += 1
+      if scores is None:
+        scores = wordScores
+      else:
+        scores = { offset: score + wordScores[offset] for offset, score in scores.items() if offset in wordScores }
+      if len(scores) == 0:
+        break
+    for offset, score in scores.items():
+      result[base + offset] = fieldScoreBase + score
+  return result
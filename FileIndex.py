@@ -0,0 +1,244 @@
+import json
+import os
+import sys
+import time
+from bisect import bisect_right
+from concurrent.futures import ThreadPoolExecutor
+from PySide import QtCore
+
+# Index of the objects of the .FCStd files which are not open: those of the directories listed in the
+# `FileIndexDirectories` string parameter (separated by os.pathsep) and the recent files.
+# The files are scanned on a worker thread, the Document.xml of the new or modified files (by modification time and size)
+# is read by a pool of worker processes (see FCStdReader), and the index is stored in the cache directory,
+# so that only the files which changed are read again in the next sessions.
+# The index is searched by the 'files' result provider, see ResultsFiles.
+
+formatVersion = 1
+rescanInterval = 300 # s, the files are scanned again when they are searched after this delay
+maxWorkerProcesses = 4
+minFilesForProcesses = 16 # fewer files are read on the worker thread, e.g. the recent files which changed since the last session
+
+def indexPath():
+  import RefreshTools
+  return os.path.join(RefreshTools.cacheDir(), 'files.json')
+
+def readIndex(path):
+  try:
+    with open(path, 'r', encoding = 'utf-8') as f:
+      index = json.load(f)
+    if index.get('version') == formatVersion:
+      return index['files']
+  except:
+    pass
+  return {}
+
+def writeIndex(path, files):
+  os.makedirs(os.path.dirname(path), exist_ok = True)
+  with open(path + '.tmp', 'w', encoding = 'utf-8') as f:
+    json.dump({ 'version': formatVersion, 'files': files }, f)
+  os.replace(path + '.tmp', path)
+
+# Paths of the .FCStd files to index, with their modification time and size
+def listFiles(directories, recentFiles):
+  files = {}
+  def add(path):
+    try:
+      stat = os.stat(path)
+      files[os.path.abspath(path)] = (stat.st_mtime_ns, stat.st_size)
+    except OSError:
+      pass
+  for directory in directories:
+    for root, dirs, names in os.walk(directory):
+      for name in names:
+        if name.lower().endswith('.fcstd'):
+          add(os.path.join(root, name))
+  for path in recentFiles:
+    if path.lower().endswith('.fcstd'):
+      add(path)
+  return files
+
+# The worker processes run the Python interpreter which comes with FreeCAD: sys.executable is usually FreeCAD itself.
+def pythonExecutable():
+  if os.path.basename(sys.executable).lower().startswith('python'):
+    return sys.executable
+  for name in ['python.exe', 'python3', 'python']:
+    path = os.path.join(os.path.dirname(sys.executable), name)
+    if os.path.isfile(path):
+      return path
+  return None
+
+# Each worker process reads the JSON list of paths on its standard input, and writes the JSON list of entries on its standard output.
+workerScript = 'import json, sys; sys.path.insert(0, sys.argv[1]); import FCStdReader; json.dump([FCStdReader.readDocument(path) for path in json.load(sys.stdin)], sys.stdout)'
+
+# Starts a few worker processes with the Python interpreter of FreeCAD and splits the files between them.
+# Plain subprocesses are used rather than multiprocessing, whose spawn executable is global to the FreeCAD process.
+def readFilesInProcesses(paths, executable):
+  import subprocess
+  nbProcesses = min(maxWorkerProcesses, os.cpu_count() or 1)
+  chunkSize = -(-len(paths) // nbProcesses)
+  chunks = [paths[i : i + chunkSize] for i in range(0, len(paths), chunkSize)]
+  processes = []
+  try:
+    for chunk in chunks:
+      process = subprocess.Popen([executable, '-c', workerScript, os.path.dirname(os.path.abspath(__file__))],
+                                 stdin = subprocess.PIPE, stdout = subprocess.PIPE, stderr = subprocess.DEVNULL,
+                                 creationflags = getattr(subprocess, 'CREATE_NO_WINDOW', 0))
+      processes.append(process)
+      process.stdin.write(json.dumps(chunk).encode('utf-8'))
+      process.stdin.close()
+    results = []
+    for process in processes:
+      output = process.stdout.read()
+      process.stdout.close()
+      if process.wait() != 0:
+        raise RuntimeError('a worker process exited with code ' + str(process.returncode))
+      results.extend(json.loads(output.decode('utf-8')))
+  finally:
+    for process in processes:
+      if process.poll() is None:
+        process.kill()
+        process.wait()
+  if len(results) != len(paths):
+    raise RuntimeError('the worker processes did not read all the files')
+  return results
+
+# Reads the files with worker processes if there are enough of them to be worth starting processes,
+# otherwise (or if processes can't be started) on the current thread.
+def readFiles(paths):
+  import FCStdReader
+  if len(paths) == 0:
+    return []
+  executable = pythonExecutable()
+  if executable is not None and len(paths) >= minFilesForProcesses:
+    try:
+      return readFilesInProcesses(paths, executable)
+    except Exception as e:
+      print('SearchBox: could not read the .FCStd files in worker processes (' + str(e) + '), reading them on a thread.')
+  results = []
+  for path in paths:
+    try:
+      results.append(FCStdReader.readDocument(path))
+    except Exception as e:
+      results.append({ 'mtime': None, 'size': None, 'label': None, 'objects': [], 'error': str(e) })
+  return results
+
+# Immutable view of the index, searched on the GUI thread: the folded labels, names and types of the files
+# and objects are joined in a blob, one line per file or object, which is scanned with str.find.
+class Snapshot():
+  def __init__(self, files):
+    import SearchIndex
+    self.paths = []   # path of each file
+    self.labels = []  # label of each file
+    self.lines = []   # (file index, [name, label, typeId] of the object or None for the file itself)
+    self.fileLines = [] # index of the line of each file, its objects follow it
+    texts = []
+    for path in sorted(files):
+      entry = files[path]
+      label = entry.get('label') or os.path.splitext(os.path.basename(path))[0]
+      fileIndex = len(self.paths)
+      self.paths.append(path)
+      self.labels.append(label)
+      self.fileLines.append(len(self.lines))
+      self.lines.append((fileIndex, None))
+      texts.append(SearchIndex.fold(label + ' ' + os.path.basename(path)))
+      for obj in entry['objects']:
+        self.lines.append((fileIndex, obj))
+        texts.append(SearchIndex.fold(' '.join(obj)))
+    self.blob = '\n'.join(text.replace('\n', ' ') for text in texts)
+    self.lineStarts = []
+    offset = 0
+    for text in texts:
+      self.lineStarts.append(offset)
+      offset += len(text) + 1
+
+  def __len__(self):
+    return len(self.lines)
+
+  # Indices of the lines containing the folded query, at most limit of them, in order.
+  # The lines of the files whose index is in skipFiles (e.g. those which are open) are not counted.
+  def search(self, q, limit, skipFiles = ()):
+    result = []
+    if q == '' or '\n' in q:
+      return result
+    pos = self.blob.find(q)
+    while pos != -1 and len(result) < limit:
+      line = bisect_right(self.lineStarts, pos) - 1
+      fileIndex = self.lines[line][0]
+      if fileIndex in skipFiles:
+        nextLine = self.fileLines[fileIndex + 1] if fileIndex + 1 < len(self.fileLines) else len(self.lineStarts)
+      else:
+        result.append(line)
+        nextLine = line + 1
+      if nextLine >= len(self.lineStarts):
+        break
+      pos = self.blob.find(q, self.lineStarts[nextLine])
+    return result
+
+class FileIndexer(QtCore.QObject):
+  updated = QtCore.Signal(object) # Snapshot; emitted from the worker thread
+  scanned = QtCore.Signal(float, int) # duration, number of files read; emitted from the worker thread
+
+  def __init__(self):
+    super(FileIndexer, self).__init__()
+    self.executor = ThreadPoolExecutor(max_workers = 1)
+    self.snapshot = None
+    self.files = None # path -> entry, only used by the worker thread
+    self.scanning = False
+    self.lastScan = None
+    # Queued connections, since the signals are emitted from another thread
+    self.updated.connect(self.onUpdated)
+    self.scanned.connect(self.onScanned)
+
+  # Scans the files again, unless a scan is running or finished recently.
+  def start(self):
+    if self.scanning or (self.lastScan is not None and time.perf_counter() - self.lastScan < rescanInterval):
+      return
+    # Read the parameters on the GUI thread, they use the FreeCAD API.
+    import FreeCAD as App
+    directories = [d for d in App.ParamGet('User parameter:BaseApp/Preferences/Mod/SearchBar').GetString('FileIndexDirectories', '').split(os.pathsep) if d.strip() != '']
+    recent = App.ParamGet('User parameter:BaseApp/Preferences/RecentFiles')
+    recentFiles = [recent.GetString('MRU' + str(i), '') for i in range(recent.GetInt('RecentFiles', 4))]
+    self.scanning = True
+    self.executor.submit(self.scan, directories, recentFiles, indexPath())
+
+  def scan(self, directories, recentFiles, path):
+    start = time.perf_counter()
+    nbRead = 0
+    try:
+      if self.files is None:
+        # Searchable as soon as the stored index is loaded
+        self.files = readIndex(path)
+        self.updated.emit(Snapshot(self.files))
+      listed = listFiles(directories, recentFiles)
+      stale = [p for p, (mtime, size) in listed.items()
+               if p not in self.files or self.files[p]['mtime'] != mtime or self.files[p]['size'] != size]
+      staleSet = set(stale)
+      files = { p: self.files[p] for p in listed if p not in staleSet }
+      for p, entry in zip(stale, readFiles(stale)):
+        files[p] = entry
+      nbRead = len(stale)
+      if files != self.files:
+        self.files = files
+        writeIndex(path, files)
+        self.updated.emit(Snapshot(files))
+    except Exception as e:
+      print('SearchBox: could not index the .FCStd files (' + str(e) + ')')
+    self.scanned.emit(time.perf_counter() - start, nbRead)
+
+  def onUpdated(self, snapshot):
+    self.snapshot = snapshot
+
+  def onScanned(self, duration, nbRead):
+    import Instrumentation
+    self.scanning = False
+    self.lastScan = time.perf_counter()
+    Instrumentation.record('files/scan', duration, nbRead)
+
+indexer = None
+
+def start():
+  global indexer
+  if indexer is None:
+    indexer = FileIndexer()
+  indexer.start()
+  return indexer
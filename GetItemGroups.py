@@ -1,12 +1,19 @@
-globalGroups = []
+globalGroups = {} # id -> itemGroup
+nextId = 0
+
+# The results are aggregated from segments: one for the cached results, and one per uncached provider.
+# Each segment is kept until its provider reports a change (see SearchResults.registerResultProvider), so
+# the itemGroups keep their ids, and the SearchIndex only indexes the segments which changed.
+segments = {} # segment name -> (version, [itemGroup], [id])
+aggregatedItemGroups = []
 
 itemGroups = None
 serializedItemGroups = None
 
 def onResultSelected(index, groupId):
   global globalGroups
-  nfo = globalGroups[groupId]
-  handlerName = nfo['action']['handler']
+  nfo = globalGroups.get(groupId)
+  handlerName = nfo['action']['handler'] if nfo is not None else None
   import SearchResults
   if handlerName in SearchResults.actionHandlers:
     SearchResults.actionHandlers[handlerName](nfo)
@@ -16,42 +23,128 @@ def onResultSelected(index, groupId):
 
 def getToolTip(groupId, setParent):
   global globalGroups
-  nfo = globalGroups[int(groupId)]
-  handlerName = nfo['action']['handler']
+  nfo = globalGroups.get(int(groupId))
+  handlerName = nfo['action']['handler'] if nfo is not None else None
   import SearchResults
   if handlerName in SearchResults.toolTipHandlers:
-    return SearchResults.toolTipHandlers[handlerName](nfo, setParent)
+    import Instrumentation
+    with Instrumentation.measure('toolTip/' + handlerName):
+      return SearchResults.toolTipHandlers[handlerName](nfo, setParent)
   else:
     return 'Could not load tooltip for this tool, it could be from a Mod that has been uninstalled. Try refreshing the list of tools.'
 
-def getItemGroups():
-  global itemGroups, serializedItemGroups, globalGroups
+# restartStreams is False when the results are refreshed because some of them have arrived, see StreamingResults.
+def getItemGroups(restartStreams = True):
+  global itemGroups, serializedItemGroups
   
   # Import the tooltip+action handlers and search result providers that are bundled with this Mod.
   # Other providers should import SearchResults and register their handlers and providers
   import BuiltInSearchResults
 
-  # Load the list of tools, preferably from the cache, if it has not already been loaded:
+  # Load the list of tools, preferably from the cache, if it has not already been loaded.
+  # The cache is read by worker threads (started by InitGui), until it is fully loaded
+  # the shards which have already been read are returned.
+  cachedItemGroups = itemGroups
   if itemGroups is None:
     if serializedItemGroups is None:
-      import RefreshTools
-      itemGroups = RefreshTools.refreshToolbars(doLoadAllWorkbenches = False)
+      import CacheLoader
+      loader = CacheLoader.start()
+      if loader.isFinished():
+        itemGroups = loader.itemGroups
+        cachedItemGroups = itemGroups
+      else:
+        cachedItemGroups = loader.partialItemGroups()
     else:
       import Serialize
       itemGroups = Serialize.deserialize(serializedItemGroups)
+      cachedItemGroups = itemGroups
 
-  # Aggregate the tools (cached) and document objects (not cached), and assign an index to each
+  # Aggregate the tools (cached) and document objects (not cached), and assign an id to each
   import SearchResults
-  igs = itemGroups
+  changed = updateSegment('cached', None, lambda: cachedItemGroups, immutable = True)
   for providerName, provider in SearchResults.resultProvidersUncached.items():
-    igs = igs + provider()
-  globalGroups = []
+    getVersion = SearchResults.uncachedVersions.get(providerName)
+    version = getVersion() if getVersion is not None else None
+    changed = updateSegment('uncached/' + providerName, version, provider) or changed
+  if len(SearchResults.resultProvidersStreaming) > 0:
+    import StreamingResults
+    if restartStreams:
+      StreamingResults.restartAll()
+    for providerName in SearchResults.resultProvidersStreaming:
+      changed = updateSegment('streaming/' + providerName, None, lambda: StreamingResults.itemGroups(providerName)) or changed
+  global aggregatedItemGroups
+  if changed:
+    # The cached results come first, they change less often, see SearchIndex
+    aggregatedItemGroups = segments['cached'][1] + [ig for providerName in SearchResults.resultProvidersUncached for ig in segments['uncached/' + providerName][1]] \
+                                                 + [ig for providerName in SearchResults.resultProvidersStreaming for ig in segments['streaming/' + providerName][1]]
+  return aggregatedItemGroups
+
+# Results of the providers which answer queries themselves, they are kept until the query changes.
+def getItemGroupsForQuery(query, limit):
+  import SearchResults
+  itemGroups = []
+  for providerName, provider in SearchResults.resultProvidersForQuery.items():
+    def getItemGroups():
+      try:
+        return provider(query, limit)[:limit]
+      except Exception as e:
+        print('SearchBox: the ' + providerName + ' result provider failed (' + str(e) + ')')
+        return []
+    updateSegment('query/' + providerName, (query, limit), getItemGroups)
+    itemGroups.extend(segments['query/' + providerName][1])
+  return itemGroups
+
+def sameItemGroups(a, b):
+  return a is b or (len(a) == len(b) and all(x is y for x, y in zip(a, b)))
+
+# ids of the itemGroups of the subtrees, in pre-order, or None if one of them has no id yet
+def subtreeIds(itemGroups):
+  ids = []
+  stack = list(reversed(itemGroups))
+  while len(stack) > 0:
+    group = stack.pop()
+    if 'id' not in group:
+      return None
+    ids.append(group['id'])
+    stack.extend(reversed(group['subitems']))
+  return ids
+
+# Returns True if the itemGroups of the segment changed. A version of None means unknown,
+# the provider is then called and the segment is kept if it returns the same itemGroups
+# (the same objects in the same order, providers often return a new list, e.g. an empty one).
+# Providers should return new top-level dicts when the subitems below them change (the SearchIndex reuses
+# the entries of the top-level itemGroups it already knows). Subitems added or replaced in place are still
+# detected by comparing the ids of the subtrees, unless immutable is True (the cached results never change in place).
+def updateSegment(name, version, getItemGroups, immutable = False):
+  global nextId
+  if name in segments and version is not None and segments[name][0] == version:
+    return False
+  import time
+  import Instrumentation
+  start = time.perf_counter()
+  itemGroups = getItemGroups()
+  duration = time.perf_counter() - start
+  if name in segments and sameItemGroups(segments[name][1], itemGroups) \
+     and (immutable or subtreeIds(itemGroups) == segments[name][2]):
+    Instrumentation.record('provider/' + name, duration, len(segments[name][2]))
+    segments[name] = (version, segments[name][1], segments[name][2])
+    return False
+  if name in segments:
+    for groupId in segments[name][2]:
+      globalGroups.pop(groupId, None)
+  # itemGroups which are still present (e.g. when the cache finishes loading) keep their id
+  ids = []
   def addId(group):
-    globalGroups.append(group)
-    group['id'] = len(globalGroups) - 1
+    global nextId
+    if 'id' not in group:
+      group['id'] = nextId
+      nextId += 1
+    globalGroups[group['id']] = group
+    ids.append(group['id'])
     for subitem in group['subitems']:
       addId(subitem)
-  for ig in igs:
+  for ig in itemGroups:
     addId(ig)
-  
-  return igs
+  segments[name] = (version, itemGroups, ids)
+  Instrumentation.record('provider/' + name, duration, len(ids))
+  return True
@@ -0,0 +1,82 @@
+from collections import OrderedDict
+from PySide import QtCore
+
+# Icons loaded from the cache are kept as handles pointing into the icon atlas,
+# and are only decoded into a QIcon when a row displaying them is painted.
+class IconHandle():
+  def __init__(self, iconId, blob):
+    self.iconId = iconId
+    self.blob = blob
+    self.images = None # QImages decoded in advance by a worker thread, see CacheLoader
+  def decodeImages(self):
+    import Serialize
+    if self.images is None:
+      self.images = Serialize.deserializeIconImages(self.blob)
+  def decode(self):
+    import Serialize
+    self.decodeImages()
+    images = self.images
+    # The QIcon is kept in the LRU below, the blob can be decoded again if it gets evicted.
+    self.images = None
+    return Serialize.iconFromImages(images)
+
+# Icons which FreeCAD can load by itself are cached as a reference instead of pixels, this keeps the cache
+# small and lets Qt render SVG icons at the exact size needed.
+# kind is 'resource' (a Qt resource path), 'file' (a file path) or 'command' (the pixmap name of a command)
+iconReferenceKinds = ['resource', 'file', 'command'] # The order of this list is part of the cache format, only append to it.
+class IconReference():
+  def __init__(self, kind, value):
+    self.kind = kind
+    self.value = value
+    self.iconId = kind + ':' + value
+  # Returns None if the icon can't be loaded (yet), e.g. when the workbench which adds the icon path
+  # of a command has not been loaded in this session.
+  def decode(self):
+    from PySide import QtGui
+    if self.kind == 'command':
+      import FreeCADGui
+      ico = FreeCADGui.getIcon(self.value) if hasattr(FreeCADGui, 'getIcon') else None
+      return ico if ico is not None and not ico.isNull() else None
+    else:
+      return QtGui.QIcon(self.value)
+
+# Returns an IconReference to the pixmap of a FreeCAD command, or None if it can't be resolved.
+def commandIconReference(commandName):
+  import os
+  import FreeCADGui
+  try:
+    pixmap = FreeCADGui.Command.get(commandName).getInfo()['pixmap']
+  except:
+    return None
+  if not pixmap:
+    return None
+  if os.path.isabs(pixmap) and os.path.isfile(pixmap):
+    return IconReference('file', pixmap)
+  for ext in ['', '.svg', '.png', '.xpm']:
+    if QtCore.QFile.exists(':/icons/' + pixmap + ext):
+      return IconReference('resource', ':/icons/' + pixmap + ext)
+  # FreeCADGui.getIcon also knows about the icon paths added by workbenches, but is not available in older versions of FreeCAD.
+  if hasattr(FreeCADGui, 'getIcon'):
+    ico = FreeCADGui.getIcon(pixmap)
+    if ico is not None and not ico.isNull():
+      return IconReference('command', pixmap)
+  return None
+
+maxDecodedIcons = 256
+decodedIcons = OrderedDict() # iconId -> QIcon, least recently used first
+
+def getIcon(icon):
+  if not isinstance(icon, (IconHandle, IconReference)):
+    return icon
+  if icon.iconId in decodedIcons:
+    decodedIcons.move_to_end(icon.iconId)
+    return decodedIcons[icon.iconId]
+  ico = icon.decode()
+  if ico is None:
+    # Not cached, the icon is loaded again the next time, once it may be available
+    from PySide import QtGui
+    return QtGui.QIcon()
+  decodedIcons[icon.iconId] = ico
+  while len(decodedIcons) > maxDecodedIcons:
+    decodedIcons.popitem(last = False)
+  return ico
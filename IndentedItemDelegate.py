@@ -1,4 +1,6 @@
 from PySide import QtGui
+import IconCache
+import ResultsModel
 
 # Inspired by https://stackoverflow.com/a/5443220/324969
 # Inspired by https://forum.qt.io/topic/69807/qtreeview-indent-entire-row
@@ -6,7 +8,14 @@ class IndentedItemDelegate(QtGui.QStyledItemDelegate):
   def __init__(self):
     super(IndentedItemDelegate, self).__init__()
   def paint(self, painter, option, index):
-    depth = int(option.widget.model().itemData(index.siblingAtColumn(1))[0])
+    depth = index.data(ResultsModel.depthRole) or 0
     indent = 16 * depth
     option.rect.adjust(indent, 0, 0, 0)
     super(IndentedItemDelegate, self).paint(painter, option, index)
+  def initStyleOption(self, option, index):
+    super(IndentedItemDelegate, self).initStyleOption(option, index)
+    # Icons from the cache are decoded lazily, only for the rows which are actually painted
+    icon = index.data(ResultsModel.iconRole)
+    if icon is not None:
+      option.icon = IconCache.getIcon(icon)
+      option.features |= QtGui.QStyleOptionViewItem.HasDecoration
@@ -11,9 +11,10 @@ def addToolSearchBox():
   mw = FreeCADGui.getMainWindow()
   if mw:
     if sea is None:
-        sea = SearchBoxLight.SearchBoxLight(getItemGroups   = lambda: __import__('GetItemGroups').getItemGroups(),
+        sea = SearchBoxLight.SearchBoxLight(getItemGroups   = lambda restartStreams = True: __import__('GetItemGroups').getItemGroups(restartStreams),
                                             getToolTip      = lambda groupId, setParent: __import__('GetItemGroups').getToolTip(groupId, setParent),
-                                            getItemDelegate = lambda: __import__('IndentedItemDelegate').IndentedItemDelegate())
+                                            getItemDelegate = lambda: __import__('IndentedItemDelegate').IndentedItemDelegate(),
+                                            getItemGroupsForQuery = lambda query, limit: __import__('GetItemGroups').getItemGroupsForQuery(query, limit))
         sea.resultSelected.connect(lambda index, groupId: __import__('GetItemGroups').onResultSelected(index, groupId))
 
     if wax is None:
@@ -32,6 +33,19 @@ def addToolSearchBox():
     mw.addToolBar(tbr)
     tbr.show()
 
+def startCacheLoader():
+  # Read the cache on worker threads as soon as FreeCAD has started, the results appear progressively in the search box.
+  loader = __import__('CacheLoader').start()
+  loader.progress.connect(lambda: sea.itemGroupsChanged() if sea is not None else None)
+  # The streaming result providers (see SearchResults.registerStreamingResultProvider) also deliver their results progressively.
+  __import__('StreamingResults').notifier.progress.connect(lambda: sea.itemGroupsChanged() if sea is not None else None)
+  # Count the changes of the document objects from the start, they decide which previews can be stored on disk.
+  __import__('ResultsDocument').installDocumentObserver()
+  # Load the index of the .FCStd files which are not open, and scan them for changes in the background.
+  __import__('FileIndex').start()
+
 addToolSearchBox()
 import FreeCADGui
 FreeCADGui.getMainWindow().workbenchActivated.connect(addToolSearchBox)
+from PySide import QtCore
+QtCore.QTimer.singleShot(0, startCacheLoader)
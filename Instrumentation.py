@@ -0,0 +1,129 @@
+import json
+import os
+import time
+
+# Opt-in measurements of where the time goes: result providers, loading the cache, searching, building tooltips
+# and the latency between a keystroke and the display of its results. Enabled by setting the `Instrumentation`
+# boolean parameter in BaseApp/Preferences/Mod/SearchBar to true. The measurements can be seen in the tooltip
+# of the "SearchBar diagnostics" result, and dumped as JSON (see ResultsDiagnostics).
+
+# Upper bounds of the buckets of the latency histograms, in milliseconds
+histogramBuckets = [1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000]
+
+class Metric():
+  def __init__(self):
+    self.count = 0
+    self.total = 0.0
+    self.max = 0.0
+    self.last = 0.0
+    self.items = None # number of items produced by the last run, if relevant
+    self.histogram = [0] * (len(histogramBuckets) + 1)
+
+  def add(self, seconds, items = None):
+    ms = seconds * 1000
+    self.count += 1
+    self.total += ms
+    self.max = max(self.max, ms)
+    self.last = ms
+    if items is not None:
+      self.items = items
+    bucket = 0
+    while bucket < len(histogramBuckets) and ms > histogramBuckets[bucket]:
+      bucket += 1
+    self.histogram[bucket] += 1
+
+  def toJSON(self):
+    return {
+      'count': self.count,
+      'totalMs': self.total,
+      'meanMs': self.total / self.count if self.count > 0 else 0,
+      'maxMs': self.max,
+      'lastMs': self.last,
+      'items': self.items,
+      'histogram': { ('<=' + str(bound) + 'ms' if i < len(histogramBuckets) else '>' + str(histogramBuckets[-1]) + 'ms'): n
+                     for i, (bound, n) in enumerate(zip(histogramBuckets + [None], self.histogram)) if n > 0 },
+    }
+
+metrics = {} # name -> Metric
+enabled = None
+pendingKeystroke = None # time.perf_counter() of the last keystroke whose results have not been displayed yet
+firstResultsPending = False
+
+def isEnabled():
+  global enabled
+  if enabled is None:
+    refresh()
+  return enabled
+
+# Reads the parameter again, called when the search box gains focus.
+def refresh():
+  global enabled
+  try:
+    import FreeCAD as App
+    enabled = App.ParamGet('User parameter:BaseApp/Preferences/Mod/SearchBar').GetBool('Instrumentation', False)
+  except:
+    enabled = False
+
+def record(name, seconds, items = None):
+  if not isEnabled():
+    return
+  if name not in metrics:
+    metrics[name] = Metric()
+  metrics[name].add(seconds, items)
+
+# with Instrumentation.measure('provider/document') as m:
+#   itemGroups = provider()
+#   m.items = len(itemGroups)
+class measure():
+  def __init__(self, name):
+    self.name = name
+    self.items = None
+  def __enter__(self):
+    self.start = time.perf_counter()
+    return self
+  def __exit__(self, exc_type, exc_value, traceback):
+    record(self.name, time.perf_counter() - self.start, self.items)
+    return False
+
+def keystroke():
+  global pendingKeystroke, firstResultsPending
+  if isEnabled():
+    pendingKeystroke = time.perf_counter()
+    firstResultsPending = True
+
+# Called when results are displayed: the first (possibly partial) results, and the final ones, of the last keystroke.
+# The paint itself happens when the event loop processes the pending update requests, before the zero-delay timer.
+def resultsDisplayed(final):
+  global pendingKeystroke, firstResultsPending
+  if pendingKeystroke is None:
+    return
+  start = pendingKeystroke
+  if firstResultsPending:
+    firstResultsPending = False
+    record('latency/keystrokeToFirstResults', time.perf_counter() - start)
+  if final:
+    from PySide import QtCore
+    pendingKeystroke = None
+    record('latency/keystrokeToFinalResults', time.perf_counter() - start)
+    QtCore.QTimer.singleShot(0, lambda: record('latency/keystrokeToPaint', time.perf_counter() - start))
+
+def toJSON():
+  return { name: metric.toJSON() for name, metric in sorted(metrics.items()) }
+
+def dumpPath():
+  import FreeCAD as App
+  return os.path.join(App.getUserAppDataDir(), 'SearchBarDiagnostics.json')
+
+def dump(path = None):
+  path = path or dumpPath()
+  with open(path, 'w', encoding = 'utf-8') as f:
+    json.dump(toJSON(), f, indent = 2)
+  return path
+
+def summaryHTML():
+  if len(metrics) == 0:
+    return '<p>Nothing was measured yet.</p>'
+  rows = ''.join('<tr><td>' + name + '</td><td>' + str(metric.count) + '</td><td>' + ('%.1f' % (metric.total / metric.count)) + '</td><td>'
+                 + ('%.1f' % metric.max) + '</td><td>' + ('%.1f' % metric.last) + '</td><td>' + ('' if metric.items is None else str(metric.items)) + '</td></tr>'
+                 for name, metric in sorted(metrics.items()))
+  return '<table><tr><th>Measure</th><th>Runs</th><th>Mean (ms)</th><th>Max (ms)</th><th>Last (ms)</th><th>Items</th></tr>' + rows + '</table>'
@@ -1,13 +1,15 @@
 import os
+import re
+import json
 import FreeCAD as App
 
-def loadAllWorkbenches():
+def loadAllWorkbenches(workbenches = None):
   from PySide import QtGui
   import FreeCADGui
   activeWorkbench = FreeCADGui.activeWorkbench().name()
   lbl = QtGui.QLabel('Loading workbench … (…/…)')
   lbl.show()
-  lst = FreeCADGui.listWorkbenches()
+  lst = FreeCADGui.listWorkbenches() if workbenches is None else workbenches
   for i, wb in enumerate(lst):
     msg = 'Loading workbench ' + wb + ' (' + str(i) + '/' + str(len(lst)) + ')'
     print(msg)
@@ -24,49 +26,188 @@ def loadAllWorkbenches():
   lbl.hide()
   FreeCADGui.activateWorkbench(activeWorkbench)
 
-def cachePath():
-  return os.path.join(App.getUserAppDataDir(), 'Cache_SearchBarMod')
+# The cache is split in shards: one per workbench for the providers registered with
+# SearchResults.registerCachedPerWorkbench, and one for each other cached provider.
+# Each shard is stamped, and is only harvested again when its stamp changes.
+def cacheDir():
+  return os.path.join(App.getUserAppDataDir(), 'Cache_SearchBarMod.d')
 
-def gatherTools():
-  itemGroups = []
+def legacyCachePaths():
+  path = os.path.join(App.getUserAppDataDir(), 'Cache_SearchBarMod')
+  return [path, path + '.icons']
+
+def cacheIndexPath():
+  return os.path.join(cacheDir(), 'index.json')
+
+def shardPath(shardName):
+  return os.path.join(cacheDir(), re.sub('[^A-Za-z0-9_.-]', '_', shardName))
+
+# Directory of the Python code of a workbench. Mods' InitGui.py files are executed (not imported)
+# by FreeCAD, so the file name is taken from the code of the workbench's methods.
+def workbenchPath(workbench):
+  for attr in type(workbench).__dict__.values():
+    code = getattr(attr, '__code__', None)
+    if code is not None and os.path.isfile(code.co_filename):
+      return os.path.dirname(os.path.abspath(code.co_filename))
+  return None
+
+def workbenchStamp(wbname):
+  import FreeCADGui
+  path = workbenchPath(FreeCADGui.listWorkbenches()[wbname])
+  mtime = None
+  if path is not None:
+    # The directory's mtime changes when files are added, removed or replaced (e.g. by git or the Addon Manager)
+    mtime = max(os.path.getmtime(p) for p in [path, os.path.join(path, 'InitGui.py'), os.path.join(path, 'package.xml')] if os.path.exists(p))
+  return { 'freecad': App.Version(), 'path': path, 'mtime': mtime }
+
+def providerStamp(providerName):
   import SearchResults
-  for providerName, provider in SearchResults.resultProvidersCached.items():
-    itemGroups = itemGroups + provider()
-  return itemGroups
+  stamp = { 'freecad': App.Version() }
+  if providerName in SearchResults.cachedStamps:
+    stamp['provider'] = SearchResults.cachedStamps[providerName]()
+  return stamp
 
-def writeCacheTools():
+# Returns a list of (shardName, providerName, workbenchName or None, stamp)
+def listShards():
+  import FreeCADGui
+  import SearchResults
+  shards = []
+  for providerName in SearchResults.resultProvidersCached:
+    if providerName in SearchResults.resultProvidersCachedPerWorkbench:
+      for wbname in sorted(FreeCADGui.listWorkbenches()):
+        shards.append((providerName + '/' + wbname, providerName, wbname, workbenchStamp(wbname)))
+    else:
+      shards.append((providerName, providerName, None, providerStamp(providerName)))
+  return shards
+
+# Returns None if the shard can't be harvested right now (e.g. its workbench isn't loaded)
+def harvestShard(providerName, wbname):
+  import SearchResults
+  if wbname is None:
+    return SearchResults.resultProvidersCached[providerName]()
+  else:
+    getItemGroupsForWorkbench, mergeItemGroups = SearchResults.resultProvidersCachedPerWorkbench[providerName]
+    return getItemGroupsForWorkbench(wbname)
+
+def readCacheIndex():
+  try:
+    with open(cacheIndexPath(), 'r', encoding='utf-8') as index:
+      return json.load(index)
+  except:
+    return {}
+
+def writeCacheIndex(index):
+  with open(cacheIndexPath(), 'w', encoding='utf-8') as f:
+    json.dump(index, f)
+
+def writeCacheShard(shardName, itemGroups):
   import Serialize
-  serializedItemGroups = Serialize.serialize(gatherTools())
-  # Todo: use wb and a specific encoding.
-  with open(cachePath(), 'w') as cache:
+  serializedItemGroups = Serialize.serialize(itemGroups)
+  with open(shardPath(shardName), 'wb') as cache:
     cache.write(serializedItemGroups)
   # I prefer to systematically deserialize, instead of taking the original version,
   # this avoids possible inconsistencies between the original and the cache and
   # makes sure cache-related bugs are noticed quickly.
+  return Serialize.deserialize(serializedItemGroups)
+
+# Raises Serialize.CacheFormatError if the shard was written by an incompatible version of this Mod.
+def readCacheShard(shardName):
   import Serialize
-  itemGroups = Serialize.deserialize(serializedItemGroups)
-  print('SearchBox: Cache has been written.')
+  return Serialize.deserializeFile(shardPath(shardName))
+
+def staleShards():
+  index = readCacheIndex()
+  return [shard for shard in listShards() if index.get(shard[0]) != shard[3]]
+
+def validShards():
+  index = readCacheIndex()
+  return [shard for shard in listShards() if index.get(shard[0]) == shard[3]]
+
+# Combines the shards of each provider, shardsOfProvider is a dict providerName -> [[itemGroup]]
+def mergeShards(shardsOfProvider):
+  import SearchResults
+  itemGroups = []
+  for providerName in SearchResults.resultProvidersCached:
+    shards = shardsOfProvider.get(providerName, [])
+    if providerName in SearchResults.resultProvidersCachedPerWorkbench:
+      getItemGroupsForWorkbench, mergeItemGroups = SearchResults.resultProvidersCachedPerWorkbench[providerName]
+      itemGroups = itemGroups + mergeItemGroups(shards)
+    else:
+      for shard in shards:
+        itemGroups = itemGroups + shard
   return itemGroups
 
-def readCacheTools():
-  # Todo: use rb and a specific encoding.
-  with open(cachePath(), 'r') as cache:
-    serializedItemGroups = cache.read()
-  import Serialize
-  itemGroups = Serialize.deserialize(serializedItemGroups)
-  print('SearchBox: Tools were loaded from the cache.')
+# Reads the shards whose stamp is still valid, and harvests the others (or all of them if forceHarvest is True).
+# readShards is an optional dict shardName -> [itemGroup] or Exception, of shards which have already been read
+# (e.g. by the CacheLoader on a worker thread).
+def refreshCache(forceHarvest = False, readShards = None):
+  import Instrumentation
+  with Instrumentation.measure('cache/refresh') as measure:
+    itemGroups = refreshCacheShards(forceHarvest, readShards)
+    measure.items = len(itemGroups)
   return itemGroups
 
+def refreshCacheShards(forceHarvest, readShards):
+  os.makedirs(cacheDir(), exist_ok = True)
+  index = readCacheIndex()
+  newIndex = {}
+  shardsOfProvider = {}
+  nbRead = 0
+  nbWritten = 0
+  for shardName, providerName, wbname, stamp in listShards():
+    itemGroups = None
+    if not forceHarvest and index.get(shardName) == stamp:
+      try:
+        if readShards is not None and shardName in readShards:
+          itemGroups = readShards[shardName]
+          if isinstance(itemGroups, Exception):
+            raise itemGroups
+        else:
+          itemGroups = readCacheShard(shardName)
+        newIndex[shardName] = stamp
+        nbRead += 1
+      except Exception as e:
+        print('SearchBox: could not read cache shard ' + shardName + ' (' + str(e) + '), it will be rebuilt.')
+        itemGroups = None
+    if itemGroups is None:
+      harvested = harvestShard(providerName, wbname)
+      if harvested is not None:
+        itemGroups = writeCacheShard(shardName, harvested)
+        newIndex[shardName] = stamp
+        nbWritten += 1
+    if itemGroups is not None:
+      shardsOfProvider.setdefault(providerName, []).append(itemGroups)
+  # Forget the shards of uninstalled workbenches and of stale shards which could not be harvested.
+  for shardName in index:
+    if shardName not in newIndex:
+      if os.path.exists(shardPath(shardName)):
+        os.remove(shardPath(shardName))
+  if newIndex != index:
+    writeCacheIndex(newIndex)
+  for path in legacyCachePaths():
+    if os.path.exists(path):
+      os.remove(path)
+  print('SearchBox: ' + str(nbRead) + ' cache shards were read, ' + str(nbWritten) + ' were written.')
+  return mergeShards(shardsOfProvider)
+
+def writeCacheTools():
+  return refreshCache(forceHarvest = True)
+
+def readCacheTools():
+  return refreshCache(forceHarvest = False)
 
 def refreshToolbars(doLoadAllWorkbenches = True):
   if doLoadAllWorkbenches:
     loadAllWorkbenches()
     return writeCacheTools()
   else:
-    try:
-      return readCacheTools()
-    except:
-      return writeCacheTools()
+    return readCacheTools()
+
+# Only loads the workbenches which were installed or updated since their tools were cached.
+def refreshStaleToolbars():
+  workbenches = sorted(set(wbname for shardName, providerName, wbname, stamp in staleShards() if wbname is not None))
+  loadAllWorkbenches(workbenches)
+  return readCacheTools()
 
 def refreshToolsAction():
   from PySide import QtGui
@@ -74,6 +215,14 @@ def refreshToolsAction():
   fw = QtGui.QApplication.focusWidget()
   if fw is not None:
     fw.clearFocus()
+  staleWorkbenches = set(wbname for shardName, providerName, wbname, stamp in staleShards() if wbname is not None)
+  if len(staleWorkbenches) > 0:
+    reply = QtGui.QMessageBox.question(None, "Load new or updated workbenches?", "Load the " + str(len(staleWorkbenches)) + " workbenches which were installed or updated since the list of tools was last refreshed? This can cause FreeCAD to become unstable, so please make sure you save your work before. It's a good idea to restart FreeCAD after this operation.", QtGui.QMessageBox.Yes, QtGui.QMessageBox.No)
+    if reply == QtGui.QMessageBox.Yes:
+      refreshStaleToolbars()
+    else:
+      print('cancelled')
+    return
   reply = QtGui.QMessageBox.question(None, "Load all workbenches?", "Load all workbenches? This can cause FreeCAD to become unstable, and this \"reload tools\" feature contained a bug that crashed freecad systematically, so please make sure you save your work before. It's a good idea to restart FreeCAD after this operation.", QtGui.QMessageBox.Yes, QtGui.QMessageBox.No)
   if reply == QtGui.QMessageBox.Yes:
     refreshToolbars()
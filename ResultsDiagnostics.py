@@ -0,0 +1,30 @@
+import os
+from PySide import QtGui
+import Serialize
+
+genericToolIcon = QtGui.QIcon(QtGui.QIcon(os.path.dirname(__file__) + '/Tango-Tools-spanner-hammer.svg'))
+
+def diagnosticsAction(nfo):
+  import Instrumentation
+  path = Instrumentation.dump()
+  print('SearchBar diagnostics written to ' + path)
+
+def diagnosticsToolTip(nfo, setParent):
+  import Instrumentation
+  return Serialize.iconToHTML(genericToolIcon) + '<p>Timings measured by SearchBar since FreeCAD started. Select this result to save them as JSON in <code>' + Instrumentation.dumpPath() + '</code>.</p>' + Instrumentation.summaryHTML()
+
+# Only offered while the instrumentation is enabled, see Instrumentation.
+# The same itemGroup is returned each time, so that it keeps its id and the results are not re-indexed.
+diagnosticsItemGroup = {
+  'icon': genericToolIcon,
+  'text': 'SearchBar diagnostics',
+  'toolTip': '',
+  'action': {'handler': 'diagnostics'},
+  'subitems': []
+}
+
+def diagnosticsResultsProvider():
+  import Instrumentation
+  if not Instrumentation.isEnabled():
+    return []
+  return [diagnosticsItemGroup]
@@ -2,8 +2,7 @@ from PySide import QtGui
 from PySide import QtCore
 import FreeCAD as App
 import FreeCADGui
-import SafeViewer
-import SearchBox
+import ThumbnailCache
 
 def documentAction(nfo):
   act = nfo['action']
@@ -16,17 +15,20 @@ def documentObjectAction(nfo):
   print('select object ' + act['document'] + '.' + act['object'])
   FreeCADGui.Selection.addSelection(act['document'], act['object'])
 
-# For some reason, the viewer always works except when used for two consecutive items in the search results: it then disappears after a short zoom-in+zoom-out animation.
-# I'm giving up on getting this viewer to work in a clean way, and will try swapping two instances so that the same one is never used twice in a row.
-# Also, in order to avoid segfaults when the module is reloaded (which causes the previous viewer to be garbage collected at some point), we're using a global property that will survive module reloads.
-if not hasattr(App, '_SearchBar3DViewer'):
-  # Toggle between 
-  App._SearchBar3DViewer = None
-  App._SearchBar3DViewerB = None
+# The previews of the objects are only rendered once the user enabled them, for this session or in the preferences.
+previewEnabledForSession = False
+
+def isPreviewEnabled():
+  return previewEnabledForSession or App.ParamGet('User parameter:BaseApp/Preferences/Mod/SearchBar').GetBool('PreviewEnabled', False)
+
+def enablePreview(forFutureSessions):
+  global previewEnabledForSession
+  previewEnabledForSession = True
+  if forFutureSessions:
+    App.ParamGet('User parameter:BaseApp/Preferences/Mod/SearchBar').SetBool('PreviewEnabled', True)
 
 class DocumentObjectToolTipWidget(QtGui.QWidget):
   def __init__(self, nfo, setParent):
-    import pivy
     super(DocumentObjectToolTipWidget, self).__init__()
     html = '<p>' + nfo['toolTip']['label'] + '</p><p><code>App.getDocument(' + repr(str(nfo['toolTip']['docName'])) + ').getObject(' + repr(str(nfo['toolTip']['name'])) + ')</code></p>'
     description = QtGui.QTextEdit()
@@ -34,37 +36,33 @@ class DocumentObjectToolTipWidget(QtGui.QWidget):
     description.setAlignment(QtCore.Qt.AlignTop)
     description.setText(html)
 
-    if App._SearchBar3DViewer is None:
-      oldFocus = QtGui.QApplication.focusWidget()
-      SearchBox.globalIgnoreFocusOut
-      SearchBox.globalIgnoreFocusOut = True
-      App._SearchBar3DViewer = SafeViewer.SafeViewer()
-      App._SearchBar3DViewerB = SafeViewer.SafeViewer()
-      oldFocus.setFocus()
-      SearchBox.globalIgnoreFocusOut = False
-      # Tried setting the preview to a fixed size to prevent it from disappearing when changing its contents, this sets it to a fixed size but doesn't actually pick the size, .resize does that but isn't enough to fix the bug.
-      #safeViewerInstance.setSizePolicy(QtGui.QSizePolicy(QtGui.QSizePolicy.Preferred, QtGui.QSizePolicy.Fixed))
-    self.preview = App._SearchBar3DViewer
-    App._SearchBar3DViewer, App._SearchBar3DViewerB = App._SearchBar3DViewerB, App._SearchBar3DViewer
-
-    obj = App.getDocument(str(nfo['toolTip']['docName'])).getObject(str(nfo['toolTip']['name']))
-
-    # This is really a bad way to do this… to prevent the setExtraInfo function from
-    # finalizing the object, we remove the parent ourselves.
-    oldParent = self.preview.parent()
+    # The preview is an image rendered offscreen (see ThumbnailCache) instead of a live 3D viewer,
+    # which was slow to update and prone to crashes. Rendering still goes through Coin, so it stays opt-in.
+    self.preview = QtGui.QLabel()
+    self.preview.setAlignment(QtCore.Qt.AlignCenter)
+    self.preview.setMinimumHeight(ThumbnailCache.thumbnailHeight)
+
     lay = QtGui.QVBoxLayout()
     lay.setContentsMargins(0,0,0,0)
     lay.setSpacing(0)
     self.setLayout(lay)
     lay.addWidget(description)
     lay.addWidget(self.preview)
-    #if oldParent is not None:
-    #  oldParent.hide() # hide before detaching, or we have widgets floating as their own window that appear for a split second in some cases.
-    #  oldParent.setParent(None)
-  
-    # Tried hiding/detaching the preview to prevent it from disappearing when changing its contents
-    #self.preview.viewer.stopAnimating()
-    self.preview.showSceneGraph(obj.ViewObject.RootNode)
+    self.optIn = None
+    if not isPreviewEnabled():
+      self.preview.hide()
+      self.optIn = QtGui.QWidget()
+      self.optIn.setLayout(QtGui.QVBoxLayout())
+      warning = QtGui.QLabel("Warning: the 3D preview has some stability issues. It can cause FreeCAD to crash and could in theory cause data loss, inside and outside of FreeCAD.")
+      warning.setWordWrap(True)
+      btnEnableForThisSession = QtGui.QPushButton('Enable 3D preview for this session')
+      btnEnableForThisSession.clicked.connect(lambda: self.enablePreview(False))
+      btnEnableForFutureSessions = QtGui.QPushButton('Enable 3D preview for future sessions')
+      btnEnableForFutureSessions.clicked.connect(lambda: self.enablePreview(True))
+      self.optIn.layout().addWidget(warning)
+      self.optIn.layout().addWidget(btnEnableForThisSession)
+      self.optIn.layout().addWidget(btnEnableForFutureSessions)
+      lay.addWidget(self.optIn)
 
     setParent(self)
     # Let the GUI recompute the side of the description based on its horizontal size.
@@ -72,45 +70,273 @@ class DocumentObjectToolTipWidget(QtGui.QWidget):
     siz = description.document().size().toSize()
     description.setFixedHeight(siz.height() + 5)
 
-  def finalizer(self):
-    #self.preview.finalizer()
-    # Detach the widget so that it may be reused without getting deleted
-    self.preview.setParent(None)
+    self.docName = str(nfo['toolTip']['docName'])
+    self.objName = str(nfo['toolTip']['name'])
+    if self.optIn is None:
+      self.requestThumbnail()
+
+  def enablePreview(self, forFutureSessions):
+    enablePreview(forFutureSessions)
+    self.optIn.hide()
+    self.preview.show()
+    self.requestThumbnail()
+
+  def requestThumbnail(self):
+    doc = App.listDocuments().get(self.docName)
+    obj = doc.getObject(self.objName) if doc is not None else None
+    if obj is None or obj.ViewObject is None:
+      self.showThumbnail(None)
+    else:
+      key, persistent = objectThumbnailKey(obj)
+      self.preview.setText('Rendering preview…')
+      ThumbnailCache.request(key, persistent, lambda: ThumbnailCache.renderSceneGraph(obj.ViewObject.RootNode), self.showThumbnail)
+
+  def showThumbnail(self, png):
+    try:
+      if png is None:
+        self.preview.setText('No preview available')
+      else:
+        pixmap = QtGui.QPixmap()
+        pixmap.loadFromData(png, 'PNG')
+        self.preview.setPixmap(pixmap)
+    except RuntimeError:
+      pass # the tooltip was replaced before the preview was rendered
 
 def documentToolTip(nfo, setParent):
-  return '<p>' + nfo['toolTip']['label'] + '</p><p><code>App.getDocument(' + repr(str(nfo['toolTip']['name'])) + ')</code></p><p><img src="data:image/png;base64,.............."></p>'
+  import base64
+  html = '<p>' + nfo['toolTip']['label'] + '</p><p><code>App.getDocument(' + repr(str(nfo['toolTip']['name'])) + ')</code></p>'
+  doc = App.listDocuments().get(str(nfo['toolTip']['name']))
+  png = ThumbnailCache.fcstdThumbnail(doc.FileName) if doc is not None and doc.FileName else None
+  if png is not None:
+    html += '<p><img src="data:image/png;base64,' + base64.b64encode(png).decode('ascii') + '"></p>'
+  return html
 
 def documentObjectToolTip(nfo, setParent):
   return DocumentObjectToolTipWidget(nfo, setParent)
 
-def documentResultsProvider():
-  itemGroups = []
-  def document(doc):
-    group = []
-    for o in doc.Objects:
-      #all_actions.append(lambda: )
-      action = { 'handler': 'documentObject', 'document': o.Document.Name, 'object': o.Name }
-      item = {
-        'icon': o.ViewObject.Icon if o.ViewObject and o.ViewObject.Icon else None,
-        'text': o.Label + ' (' + o.Name + ')',
-        # TODO: preview of the object
-        'toolTip': { 'label': o.Label, 'name': o.Name, 'docName': o.Document.Name},
-        'action': action,
-        'subitems': []
-      }
-      group.append(item)
+# The itemGroups of the documents are maintained incrementally by a document observer: the itemGroup of a document
+# is only rebuilt when its objects are created, deleted, relabeled or linked differently, and the items of its unchanged
+# objects are reused (they keep their id, see GetItemGroups). A changed document gets a new top-level dict, so that
+# the SearchIndex, which reuses the entries of the top-level itemGroups it already knows, indexes it again.
+# The objects are organized as in the tree view: the members of a group, or else the dependencies of an object
+# (its OutList), are its children. An object with children is collapsed, see SearchIndex.
+class DocumentEntry():
+  def __init__(self):
+    self.items = {} # object name -> item
+    self.group = None # top-level itemGroup, None when it must be rebuilt
+
+documentEntries = {} # document name -> DocumentEntry
+documentsVersion = 0
+# (document name, object name) -> number of changes of the object (or of its view provider) since the document
+# was loaded or saved, used to invalidate the thumbnails of the objects
+objectStamps = {}
+# Names of the documents which were open before the observers were installed: their changes until then are unknown,
+# so the thumbnails of their objects are not stored on disk until they are saved or loaded again.
+untrackedDocuments = set()
+
+def documentsChanged(doc = None, objName = None):
+  global documentsVersion
+  documentsVersion += 1
+  entry = documentEntries.get(doc.Name) if doc is not None else None
+  if entry is not None:
+    entry.group = None
+    if objName is not None:
+      entry.items.pop(objName, None)
+
+def isLinkProperty(obj, prop):
+  try:
+    return prop == 'Group' or obj.getTypeIdOfProperty(prop).startswith('App::PropertyLink')
+  except:
+    return False
+
+def objectChanged(obj):
+  key = (obj.Document.Name, obj.Name)
+  objectStamps[key] = objectStamps.get(key, 0) + 1
 
+# The saved file matches the objects again, their thumbnails can be stored on disk (see objectThumbnailKey)
+def resetObjectStamps(doc):
+  untrackedDocuments.discard(doc.Name)
+  for key in [key for key in objectStamps if key[0] == doc.Name]:
+    del objectStamps[key]
+
+class DocumentObserver():
+  def slotCreatedDocument(self, doc):
+    documentsChanged()
+  def slotDeletedDocument(self, doc):
+    documentEntries.pop(doc.Name, None)
+    untrackedDocuments.discard(doc.Name)
+    documentsChanged()
+  def slotRelabelDocument(self, doc):
+    documentsChanged(doc)
+  def slotCreatedObject(self, obj):
+    documentsChanged(obj.Document, obj.Name)
+  def slotDeletedObject(self, obj):
+    documentsChanged(obj.Document, obj.Name)
+  def slotFinishRestoreDocument(self, doc):
+    resetObjectStamps(doc)
+  def slotFinishSaveDocument(self, doc, *args):
+    resetObjectStamps(doc)
+  def slotChangedObject(self, obj, prop):
+    objectChanged(obj)
+    if prop == 'Label':
+      documentsChanged(obj.Document, obj.Name)
+    elif isLinkProperty(obj, prop):
+      # The item is kept, the tree of the document is rebuilt
+      documentsChanged(obj.Document)
+  # Undo and redo can restore objects without always notifying their creation
+  def slotUndoDocument(self, doc):
+    documentEntries.pop(doc.Name, None)
+    documentsChanged()
+  def slotRedoDocument(self, doc):
+    documentEntries.pop(doc.Name, None)
+    documentsChanged()
+
+# Changes of the view providers (colors, visibility…) also invalidate the thumbnails
+class GuiDocumentObserver():
+  def slotChangedObject(self, vp, prop):
+    try:
+      objectChanged(vp.Object)
+    except:
+      pass
+
+documentObserver = None
+
+# The observers are installed when FreeCAD starts (see InitGui), so that the changes made before the first search are counted.
+# They are stored in a global property, so that a reloaded module replaces them.
+def installDocumentObserver():
+  global documentObserver
+  if documentObserver is not None:
+    return True
+  try:
+    if getattr(App, '_SearchBarDocumentObserver', None) is not None:
+      App.removeDocumentObserver(App._SearchBarDocumentObserver)
+    documentObserver = DocumentObserver()
+    App.addDocumentObserver(documentObserver)
+    App._SearchBarDocumentObserver = documentObserver
+    untrackedDocuments.update(App.listDocuments().keys())
+  except:
+    documentObserver = None
+    return False
+  try:
+    if getattr(App, '_SearchBarGuiDocumentObserver', None) is not None:
+      FreeCADGui.removeDocumentObserver(App._SearchBarGuiDocumentObserver)
+    App._SearchBarGuiDocumentObserver = GuiDocumentObserver()
+    FreeCADGui.addDocumentObserver(App._SearchBarGuiDocumentObserver)
+  except:
+    App._SearchBarGuiDocumentObserver = None
+  return True
+
+# Key of the thumbnail of an object in the ThumbnailCache, and whether it can be stored on disk: only if the object
+# has not changed since its document was loaded or saved, as the change counts start again at 0 in the next session.
+def objectThumbnailKey(obj):
+  doc = obj.Document
+  if not installDocumentObserver():
+    return ('object', object(), obj.Name), False # the changes are not known, always render the object again
+  stamp = objectStamps.get((doc.Name, obj.Name), 0)
+  persistent = stamp == 0 and doc.FileName != '' and doc.Name not in untrackedDocuments and App._SearchBarGuiDocumentObserver is not None
+  fileStamp = doc.FileName + ':' + doc.LastModifiedDate if persistent else doc.Name
+  return ('object', fileStamp, obj.Name, stamp), persistent
+
+# Changes when the documents, their objects or their labels, or the active document change.
+# None if the observer could not be installed, the itemGroups are then rebuilt each time.
+def documentResultsVersion():
+  if not installDocumentObserver():
+    return None
+  return (documentsVersion, App.ActiveDocument.Name if App.ActiveDocument else None)
+
+def documentObjectItem(o):
+  action = { 'handler': 'documentObject', 'document': o.Document.Name, 'object': o.Name }
+  return {
+    'icon': o.ViewObject.Icon if o.ViewObject and o.ViewObject.Icon else None,
+    'text': o.Label + ' (' + o.Name + ')',
+    # TODO: preview of the object
+    'toolTip': { 'label': o.Label, 'name': o.Name, 'docName': o.Document.Name},
+    'action': action,
+    'subitems': []
+  }
+
+# Children of each object: each object is the child of the first group containing it, or else of the first object
+# depending on it. The objects without a parent (and those in a cycle) are the roots.
+# Links to the objects of other documents are ignored.
+def documentTree(doc, objects):
+  children = {}
+  parents = {}
+  for claimGroups in (True, False):
+    for o in objects:
+      try:
+        linked = getattr(o, 'Group', None) if claimGroups else o.OutList
+        linked = [child for child in linked if child.Document.Name == doc.Name] if isinstance(linked, list) else []
+      except:
+        linked = []
+      for child in linked:
+        if child.Name not in parents and child.Name != o.Name:
+          parents[child.Name] = o.Name
+          children.setdefault(o.Name, []).append(child.Name)
+  roots = []
+  visited = set()
+  # Iterative, chains of dependencies can be deeper than the recursion limit
+  def visit(name):
+    stack = [name]
+    while len(stack) > 0:
+      name = stack.pop()
+      if name not in visited:
+        visited.add(name)
+        stack.extend(children.get(name, []))
+  for o in objects:
+    if o.Name not in parents:
+      roots.append(o.Name)
+      visit(o.Name)
+  for o in objects:
+    if o.Name not in visited:
+      roots.append(o.Name)
+      visit(o.Name)
+  return roots, children
+
+def documentItemGroup(doc):
+  entry = documentEntries.setdefault(doc.Name, DocumentEntry())
+  if entry.group is None:
+    items = {}
+    objects = doc.Objects
+    for o in objects:
+      item = entry.items.get(o.Name)
+      items[o.Name] = item if item is not None else documentObjectItem(o)
+    entry.items = items
+    roots, children = documentTree(doc, objects)
+    rootItems = []
+    placed = set()
+    stack = [(name, rootItems) for name in reversed(roots)]
+    while len(stack) > 0:
+      name, siblings = stack.pop()
+      # Each object appears once, in a cycle the child which leads back to an ancestor is dropped
+      if name in placed or name not in items:
+        continue
+      placed.add(name)
+      item = items[name]
+      item['subitems'] = []
+      siblings.append(item)
+      stack.extend((child, item['subitems']) for child in reversed(children.get(name, [])))
+    for item in items.values():
+      if len(item['subitems']) > 0:
+        item['collapsed'] = True
+      else:
+        item.pop('collapsed', None)
     action = { 'handler': 'document', 'document': doc.Name }
-    itemGroups.append({
+    entry.group = {
       'icon': QtGui.QIcon(':/icons/Document.svg'),
       'text': doc.Label + ' (' + doc.Name + ')',
       # TODO: preview of the document
       'toolTip': { 'label': doc.Label, 'name': doc.Name},
-      'action':action,
-      'subitems': group })
+      'action': action,
+      'subitems': rootItems }
+  return entry.group
+
+def documentResultsProvider():
+  if not installDocumentObserver():
+    documentEntries.clear()
+  itemGroups = []
   if App.ActiveDocument:
-    document(App.ActiveDocument)
+    itemGroups.append(documentItemGroup(App.ActiveDocument))
   for docname, doc in App.listDocuments().items():
-    if not App.activeDocument or docname != App.ActiveDocument.Name:
-      document(doc)
+    if not App.ActiveDocument or docname != App.ActiveDocument.Name:
+      itemGroups.append(documentItemGroup(doc))
   return itemGroups
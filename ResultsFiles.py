@@ -0,0 +1,85 @@
+import base64
+import os
+from PySide import QtGui
+import FreeCAD as App
+import FreeCADGui
+import SearchIndex
+import ThumbnailCache
+
+# Objects of the .FCStd files which are not open, found in the index maintained by FileIndex.
+
+def openFile(path):
+  for doc in App.listDocuments().values():
+    if doc.FileName and os.path.normcase(os.path.abspath(doc.FileName)) == os.path.normcase(path):
+      return doc
+  return App.openDocument(path)
+
+def fileAction(nfo):
+  act = nfo['action']
+  print('open ' + act['path'])
+  doc = openFile(act['path'])
+  App.setActiveDocument(doc.Name)
+
+def fileObjectAction(nfo):
+  act = nfo['action']
+  print('open ' + act['path'] + ' and select object ' + act['object'])
+  doc = openFile(act['path'])
+  App.setActiveDocument(doc.Name)
+  FreeCADGui.Selection.clearSelection()
+  FreeCADGui.Selection.addSelection(doc.Name, act['object'])
+
+def thumbnailHTML(path):
+  png = ThumbnailCache.fcstdThumbnail(path)
+  if png is None:
+    return ''
+  return '<p><img src="data:image/png;base64,' + base64.b64encode(png).decode('ascii') + '"></p>'
+
+def fileToolTip(nfo, setParent):
+  return '<p>' + nfo['toolTip']['label'] + '</p><p><code>App.openDocument(' + repr(nfo['toolTip']['path']) + ')</code></p>' + thumbnailHTML(nfo['toolTip']['path'])
+
+def fileObjectToolTip(nfo, setParent):
+  return '<p>' + nfo['toolTip']['label'] + ' (' + nfo['toolTip']['typeId'] + ')</p><p>in ' + nfo['toolTip']['path'] + '</p>' \
+       + '<p><code>App.openDocument(' + repr(nfo['toolTip']['path']) + ').getObject(' + repr(nfo['toolTip']['name']) + ')</code></p>' \
+       + thumbnailHTML(nfo['toolTip']['path'])
+
+def fileItemGroup(snapshot, fileIndex, subitems):
+  path = snapshot.paths[fileIndex]
+  label = snapshot.labels[fileIndex]
+  return {
+    'icon': QtGui.QIcon(':/icons/Document.svg'),
+    'text': label + ' (' + os.path.basename(path) + ')',
+    'toolTip': { 'label': label, 'path': path },
+    'action': { 'handler': 'file', 'path': path },
+    'subitems': subitems
+  }
+
+def fileObjectItemGroup(snapshot, fileIndex, obj):
+  name, label, typeId = obj
+  path = snapshot.paths[fileIndex]
+  return {
+    'icon': None,
+    'text': label + ' (' + name + ')',
+    'toolTip': { 'label': label, 'name': name, 'typeId': typeId, 'path': path },
+    'action': { 'handler': 'fileObject', 'path': path, 'object': name },
+    'subitems': []
+  }
+
+# Files whose label or name match, and the matching objects below their file, at most limit rows.
+# The files which are already open are skipped, their objects are listed by ResultsDocument.
+def filesResultsForQuery(query, limit):
+  import FileIndex
+  snapshot = FileIndex.start().snapshot
+  if snapshot is None:
+    return []
+  openFiles = set(os.path.normcase(os.path.abspath(doc.FileName)) for doc in App.listDocuments().values() if doc.FileName)
+  skipFiles = set(i for i, path in enumerate(snapshot.paths) if os.path.normcase(path) in openFiles) if len(openFiles) > 0 else ()
+  itemGroups = []
+  lastFile = None
+  for line in snapshot.search(SearchIndex.fold(query), limit, skipFiles):
+    fileIndex, obj = snapshot.lines[line]
+    if fileIndex != lastFile:
+      itemGroups.append(fileItemGroup(snapshot, fileIndex, []))
+      lastFile = fileIndex
+    if obj is not None:
+      itemGroups[-1]['subitems'].append(fileObjectItemGroup(snapshot, fileIndex, obj))
+  return itemGroups
@@ -0,0 +1,100 @@
+from PySide import QtCore
+
+# Custom roles of the ResultsModel
+iconRole = QtCore.Qt.UserRole + 1    # a QIcon, an IconCache.IconHandle or an IconCache.IconReference, decoded by the item delegate
+depthRole = QtCore.Qt.UserRole + 2   # int, the indentation level of the row
+groupIdRole = QtCore.Qt.UserRole + 3 # int, the id of the itemGroup (see GetItemGroups), or one of the ids below
+expandedRole = QtCore.Qt.UserRole + 4 # bool, whether a collapsible row is expanded (see SearchIndex), None for the other rows
+
+placeholderGroupId = -1
+moreResultsGroupId = -2
+
+# List model backed directly by the rows computed by a SearchIndex, data() is only called
+# for the rows which the view actually paints, and updating the results only swaps the arrays.
+# The rows are fetched one page at a time (see SearchIndex.RankedRows), a synthetic
+# "N more results…" row is displayed after the last page, the view fetches the next page
+# when it is scrolled to the bottom (see canFetchMore / fetchMore).
+class ResultsModel(QtCore.QAbstractListModel):
+  def __init__(self, defaultIcon, pageSize = 20):
+    super(ResultsModel, self).__init__()
+    self.defaultIcon = defaultIcon
+    self.pageSize = pageSize
+    self.searchIndex = None
+    self.rows = None # SearchIndex.RankedRows
+    self.nbRows = 0  # number of rows of self.rows which are displayed
+    self.placeholder = None # (icon, text) of a single row displayed instead of the results
+
+  def setRows(self, searchIndex, rows):
+    self.beginResetModel()
+    self.searchIndex = searchIndex
+    self.rows = rows
+    self.nbRows = rows.fetch(self.pageSize)
+    self.placeholder = None
+    self.endResetModel()
+
+  def hasMoreRows(self):
+    return self.rows is not None and self.nbRows < len(self.rows)
+
+  def canFetchMore(self, parent = QtCore.QModelIndex()):
+    return not parent.isValid() and self.placeholder is None and self.hasMoreRows()
+
+  def fetchMore(self, parent = QtCore.QModelIndex()):
+    if not self.canFetchMore(parent):
+      return
+    first = self.nbRows
+    last = self.rows.fetch(first + self.pageSize)
+    if last < len(self.rows):
+      # Insert the new page before the "more results" row
+      self.beginInsertRows(QtCore.QModelIndex(), first, last - 1)
+      self.nbRows = last
+      self.endInsertRows()
+    else:
+      # The last page replaces the "more results" row
+      if last - first > 1:
+        self.beginInsertRows(QtCore.QModelIndex(), first + 1, last - 1)
+        self.nbRows = last
+        self.endInsertRows()
+      else:
+        self.nbRows = last
+      self.dataChanged.emit(self.index(first, 0), self.index(first, 0))
+
+  def setPlaceholder(self, icon, text):
+    self.beginResetModel()
+    self.placeholder = (icon, text)
+    self.endResetModel()
+
+  def rowCount(self, parent = QtCore.QModelIndex()):
+    if parent.isValid():
+      return 0
+    if self.placeholder is not None:
+      return 1
+    return self.nbRows + (1 if self.hasMoreRows() else 0)
+
+  def data(self, index, role = QtCore.Qt.DisplayRole):
+    if not index.isValid():
+      return None
+    if self.placeholder is not None:
+      icon, text = self.placeholder
+      return { QtCore.Qt.DisplayRole: text, iconRole: icon, depthRole: 0, groupIdRole: placeholderGroupId }.get(role)
+    if index.row() >= self.nbRows:
+      nbMore = len(self.rows) - self.nbRows
+      text = str(nbMore) + (' more result…' if nbMore == 1 else ' more results…')
+      return { QtCore.Qt.DisplayRole: text, iconRole: None, depthRole: 0, groupIdRole: moreResultsGroupId }.get(role)
+    row = self.rows.rows[index.row()]
+    group = self.searchIndex.groups[row]
+    if role == QtCore.Qt.DisplayRole:
+      if self.searchIndex.isCollapsible(row):
+        # Collapsed rows show how many of their descendants match
+        if self.searchIndex.isCollapsed(row):
+          return group['text'] + '  ▸ ' + str(self.rows.subtreeMatches(row))
+        return group['text'] + '  ▾'
+      return group['text']
+    elif role == iconRole:
+      return group['icon'] or self.defaultIcon
+    elif role == depthRole:
+      return self.searchIndex.depths[row]
+    elif role == groupIdRole:
+      return group['id']
+    elif role == expandedRole:
+      return not self.searchIndex.isCollapsed(row) if self.searchIndex.isCollapsible(row) else None
+    return None
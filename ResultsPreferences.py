@@ -3,55 +3,105 @@ import FreeCAD as App
 import FreeCADGui
 from PySide import QtGui
 import Serialize
+import IconCache
 
 genericToolIcon = QtGui.QIcon(QtGui.QIcon(os.path.dirname(__file__) + '/Tango-Tools-spanner-hammer.svg'))
 
-def getParam(grpPath, type_, name):
+def getParam(grpPath, type_, name, value):
   return {
     # TODO: use letter icon based on the type, as the preferences editor does
     'icon': genericToolIcon,
     'text': name,
     'toolTip': '',
-    'action': {'handler': 'param', 'path': grpPath, 'type': type_, 'name': name},
+    # The value is only used to find the parameter (see FieldIndex), the tooltip reads the current one.
+    'action': {'handler': 'param', 'path': grpPath, 'type': type_, 'name': name, 'value': value},
     'subitems': []
   }
 
-def getParamGroup(grpPath):
+# Types of the parameters, as named by ParameterGrp.GetContents(), and the parsing of their values in the configuration file
+paramTypes = {
+  'FCBool'  : ('Boolean',       lambda elem: elem.get('Value') == '1'),
+  'FCInt'   : ('Integer',       lambda elem: int(elem.get('Value'))),
+  'FCUInt'  : ('Unsigned Long', lambda elem: int(elem.get('Value'))),
+  'FCFloat' : ('Float',         lambda elem: float(elem.get('Value'))),
+  'FCText'  : ('String',        lambda elem: elem.text or ''),
+}
+
+def paramGroupItem(path, name, subitems):
+  return {
+    'icon': IconCache.IconReference('resource', ':/icons/Group.svg'),
+    'text': name,
+    'toolTip': '',
+    'action': { 'handler': 'paramGroup', 'path': path, 'name': name },
+    'subitems': subitems
+  }
+
+# The groups and parameters of a configuration file, read in a single streaming pass.
+# The values are those of the file, FreeCAD writes the parameters which changed since it started when it exits.
+def getParamGroups(userParameterPath, nameInPath):
+  from xml.etree import ElementTree
+  stack = [] # (path, name, params, subgroups) of the enclosing groups
+  root = None
+  for event, elem in ElementTree.iterparse(userParameterPath, events = ('start', 'end')):
+    if elem.tag == 'FCParamGroup':
+      if event == 'start':
+        name = elem.get('Name')
+        if len(stack) == 0:
+          path = nameInPath # the Root group
+          name = nameInPath
+        elif len(stack) == 1:
+          path = nameInPath + ':' + name
+        else:
+          path = stack[-1][0] + '/' + name
+        stack.append((path, name, [], []))
+      else:
+        path, name, params, subgroups = stack.pop()
+        # The parameters of the Root group are not listed
+        group = paramGroupItem(path, name, (params if len(stack) > 0 else []) + subgroups)
+        if len(stack) > 0:
+          stack[-1][3].append(group)
+        else:
+          root = group
+        elem.clear()
+    elif event == 'end' and elem.tag in paramTypes and len(stack) > 0:
+      type_, parse = paramTypes[elem.tag]
+      try:
+        value = parse(elem)
+      except:
+        value = elem.get('Value')
+      stack[-1][2].append(getParam(stack[-1][0], type_, elem.get('Name'), value))
+  return root
+
+def userParameterPath():
+  return App.ConfigGet('UserParameter')
+
+# Changes when the configuration file is written, the cached parameters are then harvested again (see RefreshTools).
+def paramStamp():
+  path = userParameterPath()
   try:
-    grp = App.ParamGet(grpPath)
+    stat = os.stat(path)
+    return { 'path': path, 'mtime': stat.st_mtime_ns, 'size': stat.st_size }
   except:
-    return []
-  contents = grp.GetContents()
-  if contents is not None:
-    return [getParam(grpPath, type_, name) for (type_, name, value) in contents]
-  else:
-    return []
+    return { 'path': path }
 
-def getParamGroups(nameInConfig, nameInPath):
-    userParameterPath = App.ConfigGet(nameInConfig)
-    from lxml import etree
-    xml = etree.parse(userParameterPath).getroot()
-    xml.find('FCParamGroup[@Name="Root"]')
-    root = xml.find('FCParamGroup[@Name="Root"]')
-    def recur(atRoot, path, name, tree):
-      params = [] if atRoot else getParamGroup(path)
-      subgroups = [recur(False, path + (':' if atRoot else '/') + child.attrib['Name'], child.attrib['Name'], child) for child in tree.getchildren() if child.tag == 'FCParamGroup']
-      return {
-        'icon': QtGui.QIcon(':/icons/Group.svg'),
-        'text': name,
-        'toolTip': '',
-        'action': { 'handler': 'paramGroup', 'path': path, 'name': name },
-        'subitems': params + subgroups
-      }
-    return recur(True, nameInPath, nameInPath, root)
+# The parameters of the last file which was read, and its stamp
+parsedParams = (None, None)
 
+# Returns None if the configuration file can't be parsed.
 def getAllParams():
+  global parsedParams
+  stamp = paramStamp()
+  if parsedParams[0] == stamp and 'mtime' in stamp:
+    return parsedParams[1]
   try:
-    from lxml import etree
-    return [getParamGroups('UserParameter', 'User parameter')]
-  except:
-    print('Could not load the list of all parameters. Please install the LXML python library with:\npython -m pip install --upgrade lxml')
-    return []
+    root = getParamGroups(userParameterPath(), 'User parameter')
+  except Exception as e:
+    # No shard is written (see RefreshTools.harvestShard), the parameters are harvested again on the next refresh
+    print('Could not load the list of all parameters (' + str(e) + ')')
+    return None
+  itemGroups = [root] if root is not None else []
+  parsedParams = (stamp, itemGroups)
+  return itemGroups
 
 def paramGroupAction(nfo):
   FreeCADGui.runCommand('Std_DlgParameter',0)
@@ -1,6 +1,7 @@
 from PySide import QtGui
 import FreeCADGui
 import Serialize
+import IconCache
 
 def toolbarAction(nfo):
   act = nfo['action']
@@ -68,9 +69,16 @@ def getAllToolbars():
       all_tbs[tb].add(wbname)
   return all_tbs
 
-def toolbarResultsProvider():
+# Prefer a reference to the icon of the command, the cache then doesn't need to store its pixels.
+def actionIcon(action, icon):
+  if action is not None and action.objectName():
+    reference = IconCache.commandIconReference(action.objectName())
+    if reference is not None:
+      return reference
+  return icon
+
+def getToolbarItemGroups(all_tbs):
   itemGroups = []
-  all_tbs = getAllToolbars()
   mw = FreeCADGui.getMainWindow()
   for toolbarName, toolbarIsInWorkbenches in all_tbs.items():
     toolbarIsInWorkbenches = sorted(list(toolbarIsInWorkbenches))
@@ -81,7 +89,7 @@ def toolbarResultsProvider():
         act = tbt.defaultAction()
         if text != '':
             # TODO: there also is the tooltip
-            icon = tbt.icon()
+            icon = actionIcon(act, tbt.icon())
             men = tbt.menu()
             subgroup = []
             if men:
@@ -89,17 +97,57 @@ def toolbarResultsProvider():
               for mac in men.actions():
                 if mac.text():
                   action = { 'handler': 'subTool', 'workbenches': toolbarIsInWorkbenches, 'toolbar': toolbarName, 'tool': text, 'subTool': mac.text() }
-                  subgroup.append({'icon':mac.icon(), 'text':mac.text(), 'toolTip': mac.toolTip(), 'action':action, 'subitems':[]})
+                  subgroup.append({'icon':actionIcon(mac, mac.icon()), 'text':mac.text(), 'toolTip': mac.toolTip(), 'action':action, 'subitems':[]})
             # The default action of a menu changes dynamically, instead of triggering the last action, just show the menu.
             action = { 'handler': 'tool', 'workbenches': toolbarIsInWorkbenches, 'toolbar': toolbarName, 'tool': text, 'showMenu': bool(men) }
             group.append({'icon':icon, 'text':text, 'toolTip': tbt.toolTip(), 'action': action, 'subitems': subgroup})
       # TODO: move the 'workbenches' field to the itemgroup
       action = { 'handler': 'toolbar', 'workbenches': toolbarIsInWorkbenches, 'toolbar': toolbarName }
       itemGroups.append({
-        'icon': QtGui.QIcon(':/icons/Group.svg'),
+        'icon': IconCache.IconReference('resource', ':/icons/Group.svg'),
         'text': toolbarName,
         'toolTip': '',
         'action': action,
         'subitems': group
       })
   return itemGroups
+
+def toolbarResultsProvider():
+  return getToolbarItemGroups(getAllToolbars())
+
+# Returns None if the workbench has not been loaded yet, its toolbars are then unknown.
+def workbenchToolbarResultsProvider(wbname):
+  try:
+    tbs = FreeCADGui.listWorkbenches()[wbname].listToolbars()
+  except:
+    return None
+  return getToolbarItemGroups({ tb: [wbname] for tb in tbs })
+
+# The toolbars shared by several workbenches appear in the results of each of them, keep a single copy.
+# The itemGroups of the shards are not modified (the CacheLoader's worker threads may still be indexing them):
+# a toolbar shared by several workbenches is copied with the union of their names, without the field index
+# of the original, which was built with a single workbench (see FieldIndex).
+def mergeWorkbenchToolbarResults(itemGroupsPerWorkbench):
+  workbenchesOfToolbar = {}
+  for itemGroups in itemGroupsPerWorkbench:
+    for group in itemGroups:
+      workbenchesOfToolbar.setdefault(group['action']['toolbar'], set()).update(group['action']['workbenches'])
+  def withWorkbenches(group, workbenches):
+    copy = { key: value for key, value in group.items() if key != 'fields' }
+    copy['action'] = dict(group['action'], workbenches = workbenches)
+    copy['subitems'] = [withWorkbenches(subitem, workbenches) for subitem in group['subitems']]
+    return copy
+  merged = []
+  seen = set()
+  for itemGroups in itemGroupsPerWorkbench:
+    toolbars = set()
+    for group in itemGroups:
+      toolbar = group['action']['toolbar']
+      if toolbar not in seen:
+        toolbars.add(toolbar)
+        workbenches = sorted(workbenchesOfToolbar[toolbar])
+        if workbenches != group['action']['workbenches']:
+          group = withWorkbenches(group, workbenches)
+        merged.append(group)
+    seen.update(toolbars)
+  return merged
@@ -1,8 +1,13 @@
 import os
 from PySide import QtGui
 from PySide import QtCore
+import FreeCAD as App
 import FreeCADGui # just used for FreeCADGui.updateGui()
 from SearchBoxLight import SearchBoxLight
+import ResultsModel
+import SearchIndex
+import SearchScheduler
+import Instrumentation
 
 globalIgnoreFocusOut = False
 
@@ -25,6 +30,7 @@ class SearchBox(QtGui.QLineEdit):
     if self.isInitialized:
       return self
     getItemGroups = self.getItemGroups
+    getItemGroupsForQuery = self.getItemGroupsForQuery
     getToolTip = self.getToolTip
     getItemDelegate = self.getItemDelegate
     maxVisibleRows = self.maxVisibleRows
@@ -46,20 +52,27 @@ class SearchBox(QtGui.QLineEdit):
     # Save arguments
     #self.model = model
     self.getItemGroups = getItemGroups
+    self.getItemGroupsForQuery = getItemGroupsForQuery
     self.getToolTip = getToolTip
     self.itemGroups = None # Will be initialized by calling getItemGroups() the first time the search box gains focus, through focusInEvent and refreshItemGroups
+    self.searchIndex = None # Flat index of self.itemGroups, rebuilt by refreshItemGroups
+    self.matchMode = 'substring' # One of SearchIndex.matchModes, read from the preferences by refreshItemGroups
     self.maxVisibleRows = maxVisibleRows # TODO: use this to compute the correct height
-    # Create proxy model
-    self.proxyModel = QtCore.QIdentityProxyModel()
-    # Filtered model to which items are manually added. Store it as a property of the object instead of a local variable, to prevent grbage collection.
-    self.mdl = QtGui.QStandardItemModel()
-    #self.proxyModel.setModel(self.model)
+    # Model of the filtered results, backed by the arrays of the search index. Store it as a property of the object instead of a local variable, to prevent grbage collection.
+    self.mdl = ResultsModel.ResultsModel(genericToolIcon, maxVisibleRows)
+    # Searches are coalesced and run in time slices, the results are published by showResults
+    self.searchScheduler = SearchScheduler.SearchScheduler(maxVisibleRows)
+    self.searchScheduler.results.connect(self.showResults)
+    if getItemGroupsForQuery is not None:
+      self.searchScheduler.pushDown = self.pushDownQuery
+    self.publishedGeneration = None
+    self.toggledRow = None # (groupId, row) of the row which was just expanded or collapsed, it stays selected
     # Create list view
     self.listView = QtGui.QListView(self)
     self.listView.setWindowFlags(QtGui.Qt.ToolTip)
     self.listView.setWindowFlag(QtGui.Qt.FramelessWindowHint)
     self.listView.setSelectionMode(QtGui.QAbstractItemView.SingleSelection)
-    self.listView.setModel(self.proxyModel)
+    self.listView.setModel(self.mdl)
     self.listView.setItemDelegate(getItemDelegate()) # https://stackoverflow.com/a/65930408/324969
     # make the QListView non-editable
     self.listView.setEditTriggers(QtGui.QAbstractItemView.NoEditTriggers)
@@ -99,6 +112,12 @@ class SearchBox(QtGui.QLineEdit):
     
     QtGui.QShortcut(QtGui.QKeySequence(QtCore.Qt.Key_Escape), self, context = wdgctx).activated.connect(self.listCancel)
 
+    # Coalesce the notifications sent while the cache is loading progressively
+    self.itemGroupsChangedTimer = QtCore.QTimer()
+    self.itemGroupsChangedTimer.setSingleShot(True)
+    self.itemGroupsChangedTimer.setInterval(100)
+    self.itemGroupsChangedTimer.timeout.connect(self.refreshVisibleItemGroups)
+
     # Initialize the model with the full list (assuming the text() is empty)
     #self.proxyFilterModel(self.text()) # This is done by refreshItemGroups on focusInEvent, because the initial loading from cache can take time
     self.firstShowList = True
@@ -106,23 +125,37 @@ class SearchBox(QtGui.QLineEdit):
     return self
 
   @staticmethod
-  def refreshItemGroups(self):
-    self.itemGroups = self.getItemGroups()
-    self.proxyFilterModel(self.text())
+  def refreshItemGroups(self, restartStreams = True):
+    self.itemGroups = self.getItemGroups(restartStreams)
+    matchMode = App.ParamGet('User parameter:BaseApp/Preferences/Mod/SearchBar').GetString('MatchMode', 'substring')
+    self.matchMode = matchMode if matchMode in SearchIndex.matchModes else 'substring'
+    # Keep the index (and its cache of recent queries) if the item groups did not change,
+    # otherwise only index the segments which changed (see GetItemGroups)
+    if self.searchIndex is None or self.searchIndex.itemGroups is not self.itemGroups:
+      self.searchIndex = SearchIndex.SearchIndex(self.itemGroups, self.searchIndex)
+      self.searchIndex.useTrigrams = App.ParamGet('User parameter:BaseApp/Preferences/Mod/SearchBar').GetBool('TrigramIndex', True)
+      self.searchIndex.useFields = App.ParamGet('User parameter:BaseApp/Preferences/Mod/SearchBar').GetBool('FieldIndex', True)
+    self.searchScheduler.schedule(self.searchIndex, self.text(), self.matchMode, immediate = True)
+
+  @staticmethod
+  def proxyItemGroupsChanged(self):
+    self.itemGroupsChangedTimer.start()
+
+  @staticmethod
+  def refreshVisibleItemGroups(self):
+    if self.listView.isVisible():
+      self.refreshItemGroups(restartStreams = False)
 
   @staticmethod
   def proxyFocusInEvent(self, qFocusEvent):
     if self.firstShowList:
-      mdl = QtGui.QStandardItemModel()
-      mdl.appendRow([QtGui.QStandardItem(genericToolIcon, 'Please wait, loading results from cache…'),
-                     QtGui.QStandardItem('0'),
-                     QtGui.QStandardItem('-1')])
-      self.proxyModel.setSourceModel(mdl)
+      self.mdl.setPlaceholder(genericToolIcon, 'Please wait, loading results from cache…')
       self.showList()
       self.firstShowList = False
       FreeCADGui.updateGui()
     global globalIgnoreFocusOut
     if not globalIgnoreFocusOut:
+      Instrumentation.refresh()
       self.refreshItemGroups()
     self.showList()
     super(SearchBoxLight, self).focusInEvent(qFocusEvent)
@@ -144,6 +177,10 @@ class SearchBox(QtGui.QLineEdit):
         if nbRows > 0:
           newRow = rowUpdate(currentRow, nbRows)
           index = self.listView.model().index(newRow, 0)
+          if index.data(ResultsModel.groupIdRole) == ResultsModel.moreResultsGroupId:
+            # The next page is inserted before the "more results" row, select its first result
+            self.mdl.fetchMore()
+            index = self.listView.model().index(newRow, 0)
           self.listView.setCurrentIndex(index)
 
   @staticmethod
@@ -210,7 +247,15 @@ class SearchBox(QtGui.QLineEdit):
 
   @staticmethod
   def selectResult(self, mode, index):
-    groupId = int(index.model().itemData(index.siblingAtColumn(2))[0])
+    groupId = index.data(ResultsModel.groupIdRole)
+    if groupId == ResultsModel.moreResultsGroupId:
+      self.mdl.fetchMore()
+      return
+    if groupId < 0:
+      return # placeholder row
+    if mode == 'toggle' and index.data(ResultsModel.expandedRole) is not None:
+      self.toggleExpanded(groupId, index.row())
+      return
     self.hideList()
     # TODO: allow other options, e.g. some items could act as combinators / cumulative filters
     self.setText('')
@@ -218,40 +263,53 @@ class SearchBox(QtGui.QLineEdit):
     # TODO: emit index relative to the base model
     self.resultSelected.emit(index, groupId)
 
+  # Expands or collapses a row (Ctrl+Space), its descendants are only listed while it is expanded
+  @staticmethod
+  def toggleExpanded(self, groupId, row):
+    self.searchIndex.toggleExpanded(groupId)
+    self.toggledRow = (groupId, row)
+    self.searchScheduler.schedule(self.searchIndex, self.text(), self.matchMode, immediate = True)
+
   @staticmethod
   def proxyFilterModel(self, userInput):
-    # TODO: this will cause a race condition if it is accessed while being modified
-    def matches(s):
-      return userInput.lower() in s.lower()
-    def filterGroup(group):
-      if matches(group['text']):
-        # If a group matches, include the entire subtree (might need to disable this if it causes too much noise)
-        return group
-      else:
-        subitems = filterGroups(group['subitems'])
-        if len(subitems) > 0 or matches(group['text']):
-          return { 'id': group['id'], 'text': group['text'], 'icon': group['icon'], 'action': group['action'], 'toolTip':group['toolTip'], 'subitems': subitems }
-        else:
-          return None
-    def filterGroups(groups):
-      groups = (filterGroup(group) for group in groups)
-      return [group for group in groups if group is not None]
-    self.mdl = QtGui.QStandardItemModel()
-    self.mdl.appendColumn([])
-    def addGroups(filteredGroups, depth=0):
-      for group in filteredGroups:
-        # TODO: this is not very clean, we should memorize the index from the original itemgroups
-        self.mdl.appendRow([QtGui.QStandardItem(group['icon'] or genericToolIcon, group['text']),
-                            QtGui.QStandardItem(str(depth)),
-                            QtGui.QStandardItem(str(group['id']))])
-        addGroups(group['subitems'], depth+1)
-    addGroups(filterGroups(self.itemGroups))
-    self.proxyModel.setSourceModel(self.mdl)
-    self.currentExtraInfo = None # Unset this so that the ExtraInfo can be updated
-    # TODO: try to find the already-highlighted item
+    if self.searchIndex is None:
+      return # The item groups are loaded when the search box gains focus
+    Instrumentation.keystroke()
+    self.searchScheduler.schedule(self.searchIndex, userInput, self.matchMode)
+
+  # Adds the results of the providers which answer the queries themselves after the final results
+  @staticmethod
+  def pushDownQuery(self, searchIndex, query, mode, rows):
+    itemGroups = self.getItemGroupsForQuery(query, 5 * self.maxVisibleRows)
+    if len(itemGroups) == 0:
+      return searchIndex, rows
+    extended = searchIndex.extend(itemGroups)
+    return extended, SearchIndex.AppendedRows(rows, range(len(searchIndex), len(extended)))
+
+  @staticmethod
+  def showResults(self, searchIndex, rows, final, generation):
+    # When the final results replace the partial results of the same search, keep the highlighted item
+    selectedGroupId = None
+    if generation == self.publishedGeneration and self.listView.currentIndex().isValid():
+      selectedGroupId = self.listView.currentIndex().data(ResultsModel.groupIdRole)
+    self.publishedGeneration = generation
+    self.mdl.setRows(searchIndex, rows)
+    if self.toggledRow is not None:
+      selectedGroupId, toggledRow = self.toggledRow
+      self.toggledRow = None
+      # The toggled row has not moved, make sure its page is displayed again
+      while self.mdl.nbRows <= toggledRow and self.mdl.canFetchMore():
+        self.mdl.fetchMore()
+    Instrumentation.resultsDisplayed(final)
     nbRows = self.listView.model().rowCount()
     if nbRows > 0:
-      index = self.listView.model().index(0, 0)
+      row = 0
+      if selectedGroupId is not None:
+        for i, r in enumerate(rows.rows[:self.mdl.nbRows]):
+          if searchIndex.groups[r]['id'] == selectedGroupId:
+            row = i
+            break
+      index = self.listView.model().index(row, 0)
       self.listView.setCurrentIndex(index)
       self.setExtraInfo(index)
     else:
@@ -299,7 +357,9 @@ class SearchBox(QtGui.QLineEdit):
     # index in deselected.indexes()
     selected = selected.indexes()
     deselected = deselected.indexes()
-    if len(selected) > 0:
+    if len(selected) > 0 and selected[0].data(ResultsModel.groupIdRole) < 0:
+      self.hideExtraInfo() # placeholder or "more results" row
+    elif len(selected) > 0:
       index = selected[0]
       self.setExtraInfo(index)
       # Poor attempt to circumvent a glitch where the extra info pane stays visible after pressing Return
@@ -310,11 +370,12 @@ class SearchBox(QtGui.QLineEdit):
 
   @staticmethod
   def setExtraInfo(self, index):
-    if self.currentExtraInfo == (index.row(), index.column(), index.model()):
+    extraInfo = (index.data(ResultsModel.groupIdRole), self.mdl.searchIndex)
+    if self.currentExtraInfo == extraInfo:
       # avoid useless updates of the extra info window; this also prevents segfaults when the widget
       # is replaced when selecting an option from the right-click context menu
       return
-    self.currentExtraInfo = (index.row(), index.column(), index.model())
+    self.currentExtraInfo = extraInfo
     # TODO: use an atomic swap or mutex if possible
     if self.setExtraInfoIsActive:
       self.pendingExtraInfo = index
@@ -328,7 +389,7 @@ class SearchBox(QtGui.QLineEdit):
       # be queued by the code a few lines above this one, and the loop will continue processing
       # until an iteration during which no further call was made.
       while True:
-        groupId = str(index.model().itemData(index.siblingAtColumn(2))[0])
+        groupId = str(index.data(ResultsModel.groupIdRole))
         # TODO: move this outside of this class, probably use a single metadata
         # This is a hack to allow some widgets to set the parent and recompute their size
         # during their construction.
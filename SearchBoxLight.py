@@ -4,11 +4,12 @@ from PySide import QtCore
 # This is a "light" version of the SearchBox implementation, which loads the actual implementation on first click
 class SearchBoxLight(QtGui.QLineEdit):
   resultSelected = QtCore.Signal(int, int)
-  def __init__(self, getItemGroups, getToolTip, getItemDelegate, maxVisibleRows = 20, parent = None):
+  def __init__(self, getItemGroups, getToolTip, getItemDelegate, maxVisibleRows = 20, parent = None, getItemGroupsForQuery = None):
     self.isInitialized = False
 
     # Store arguments
     self.getItemGroups = getItemGroups
+    self.getItemGroupsForQuery = getItemGroupsForQuery
     self.getToolTip = getToolTip
     self.getItemDelegate = getItemDelegate
     self.maxVisibleRows = maxVisibleRows
@@ -26,6 +27,10 @@ class SearchBoxLight(QtGui.QLineEdit):
     self.setFixedWidth(200) # needed to avoid a change of width when the clear button appears/disappears
   def lazyInit(self):
     pass
+  def itemGroupsChanged(self):
+    # Nothing to refresh if the search box has never been used
+    if self.isInitialized:
+      self.proxyItemGroupsChanged()
   def __getattr__(self, name):
     import types
     def f(*args, **kwargs):
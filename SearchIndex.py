@@ -0,0 +1,503 @@
+import heapq
+import re
+import time
+import unicodedata
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict
+
+# Case-folded text without accents, so that e.g. "Esquisse" matches "esquissé"
+def fold(s):
+  if s.isascii():
+    return s.lower()
+  s = unicodedata.normalize('NFKD', s)
+  return ''.join(c for c in s if not unicodedata.combining(c)).casefold()
+
+# substring: the query appears anywhere in the text
+# prefix: the query appears at the start of a word of the text
+# fuzzy: the characters of the query appear in that order in the text, e.g. "pcb" matches "Part Cube Box"
+matchModes = ['substring', 'prefix', 'fuzzy']
+
+# Scoring of fuzzy matches, in the spirit of fzf: each matched character scores, characters at the start
+# of a word (or of a camelCase hump) and consecutive characters get a bonus, gaps are penalized.
+scoreMatch = 16
+bonusBoundary = 8
+bonusConsecutive = 4
+bonusFirstCharacter = 8
+penaltyGapStart = 3
+penaltyGapExtension = 1
+
+maxCachedQueries = 32
+
+# Flat, pre-order view of a tree of itemGroups, built once when the item groups are refreshed,
+# so that filtering the results on each keystroke is a linear scan over the texts,
+# without walking the tree or allocating new itemGroups.
+# The results of recent queries are cached in the index, a new generation of itemGroups
+# gets a new index and therefore an empty cache.
+# The entries of the leading top-level itemGroups which are shared with the previous generation
+# (usually the cached results, when only the uncached ones changed, see GetItemGroups) are copied from it.
+# An itemGroup with a 'collapsed' key set to True (e.g. a document object with dependencies, see ResultsDocument)
+# is displayed without its subtree unless it is expanded, its matching descendants are still displayed below it.
+class SearchIndex():
+  def __init__(self, itemGroups, previous = None):
+    self.itemGroups = itemGroups
+    self.cachedQueries = OrderedDict() # (mode, folded query) -> (matches, scores, rows), least recently used first
+    self.groups = []      # the itemGroups, in pre-order
+    self.texts = []       # folded text of each itemGroup
+    self.parents = []     # index of the parent of each itemGroup, or -1
+    self.depths = []      # depth of each itemGroup
+    self.subtreeEnds = [] # the subtree of the itemGroup at index i spans the indices [i, subtreeEnds[i])
+    self.topLevel = []    # (index, itemGroup) of the top-level itemGroups
+    self.masks = []       # see charMasks
+    self.collapsible = [] # indices of the itemGroups which are collapsed unless expanded, in pre-order
+    # ids of the expanded itemGroups, shared with the previous generation so that they stay expanded
+    self.expanded = previous.expanded if previous is not None else set()
+    reused = 0
+    if previous is not None:
+      while reused < min(len(itemGroups), len(previous.topLevel)) and previous.topLevel[reused][1] is itemGroups[reused] \
+            and previous.sameSubtree(reused):
+        reused += 1
+    if reused > 0:
+      end = previous.topLevel[reused][0] if reused < len(previous.topLevel) else len(previous.groups)
+      self.groups = previous.groups[:end]
+      self.texts = previous.texts[:end]
+      self.parents = previous.parents[:end]
+      self.depths = previous.depths[:end]
+      self.subtreeEnds = previous.subtreeEnds[:end]
+      self.topLevel = previous.topLevel[:reused]
+      self.masks = previous.masks[:end]
+      self.collapsible = previous.collapsible[:bisect_left(previous.collapsible, end)]
+    def add(group, parent, depth):
+      i = len(self.groups)
+      self.groups.append(group)
+      self.texts.append(fold(group['text']))
+      self.parents.append(parent)
+      self.depths.append(depth)
+      self.subtreeEnds.append(None)
+      if group.get('collapsed'):
+        self.collapsible.append(i)
+      for subitem in group['subitems']:
+        add(subitem, i, depth + 1)
+      self.subtreeEnds[i] = len(self.groups)
+    for group in itemGroups[reused:]:
+      self.topLevel.append((len(self.groups), group))
+      add(group, -1, 0)
+    self.useTrigrams = False # see TrigramIndex
+    self.useFields = False   # see FieldIndex
+    # Computed lazily, only if needed by the match mode
+    self.blob = None       # all the folded texts, one per line
+    self.lineStarts = None # offset of each line in the blob
+    self.masks.extend([None] * (len(self.groups) - len(self.masks)))
+    self.collapsedNodes = None # indices of the collapsed itemGroups, computed lazily
+    self.blockSizes = {} # index -> number of rows displayed for its subtree, see blockRanges
+
+  def __len__(self):
+    return len(self.groups)
+
+  # Whether the subtree of the k-th top-level itemGroup still contains the itemGroups indexed for it,
+  # i.e. its subitems were not added, removed or replaced in place since it was indexed.
+  def sameSubtree(self, k):
+    i, group = self.topLevel[k]
+    end = self.subtreeEnds[i]
+    stack = [group]
+    while len(stack) > 0:
+      g = stack.pop()
+      if i >= end or self.groups[i] is not g:
+        return False
+      i += 1
+      stack.extend(reversed(g['subitems']))
+    return i == end
+
+  def isCollapsible(self, i):
+    return bool(self.groups[i].get('collapsed'))
+
+  def isCollapsed(self, i):
+    return self.isCollapsible(i) and self.groups[i].get('id') not in self.expanded
+
+  # Expands or collapses an itemGroup, the results of the previous queries are forgotten.
+  def toggleExpanded(self, groupId):
+    if groupId in self.expanded:
+      self.expanded.remove(groupId)
+    else:
+      self.expanded.add(groupId)
+    self.collapsedNodes = None
+    self.blockSizes = {}
+    self.cachedQueries.clear()
+
+  # Ranges of the rows displayed for the subtree of the itemGroup at index i: the descendants
+  # of the collapsed itemGroups are skipped.
+  def blockRanges(self, i):
+    if self.collapsedNodes is None:
+      self.collapsedNodes = [c for c in self.collapsible if self.isCollapsed(c)]
+    collapsedNodes = self.collapsedNodes
+    end = self.subtreeEnds[i]
+    start = i
+    k = bisect_right(collapsedNodes, i)
+    while k < len(collapsedNodes) and collapsedNodes[k] < end:
+      c = collapsedNodes[k]
+      yield range(start, c + 1)
+      start = self.subtreeEnds[c]
+      k = bisect_left(collapsedNodes, start, k)
+    if start < end:
+      yield range(start, end)
+
+  def blockSize(self, i):
+    size = self.blockSizes.get(i)
+    if size is None:
+      size = sum(len(r) for r in self.blockRanges(i))
+      self.blockSizes[i] = size
+    return size
+
+  # Bit-parallel representation of the folded text of an itemGroup: for each character, a bitmask of
+  # its positions in the text, and a bitmask of the positions which start a word or a camelCase hump.
+  def charMasks(self, i):
+    cached = self.masks[i]
+    if cached is None:
+      masks = {}
+      boundaries = 0
+      pos = 0
+      prev = ''
+      for c in self.groups[i]['text']:
+        f = fold(c)
+        if f == '':
+          continue
+        if c.isalnum() and (not prev.isalnum() or (c.isupper() and prev.islower()) or (c.isdigit() != prev.isdigit())):
+          boundaries |= 1 << pos
+        for fc in f:
+          masks[fc] = masks.get(fc, 0) | (1 << pos)
+          pos += 1
+        prev = c
+      cached = (masks, boundaries)
+      self.masks[i] = cached
+    return cached
+
+  # Indices of the lines of the blob matching a regular expression which can't span several lines.
+  # The scan itself runs in the regular expression engine, only the matches are visited in Python.
+  def scanLines(self, pattern):
+    if self.blob is None:
+      self.blob = '\n'.join(text.replace('\n', ' ') for text in self.texts)
+      self.lineStarts = []
+      offset = 0
+      for text in self.texts:
+        self.lineStarts.append(offset)
+        offset += len(text) + 1
+    lineStarts = self.lineStarts
+    lines = []
+    last = -1
+    for m in pattern.finditer(self.blob):
+      line = bisect_right(lineStarts, m.start()) - 1
+      if line != last:
+        lines.append(line)
+        last = line
+    return lines
+
+  def matchSubstring(self, q, candidates):
+    texts = self.texts
+    matches = [i for i in candidates if q in texts[i]]
+    scores = []
+    for i in matches:
+      text = texts[i]
+      pos = text.find(q)
+      if pos == 0:
+        scores.append(2)
+      else:
+        while pos > 0 and text[pos - 1].isalnum():
+          pos = text.find(q, pos + 1)
+        scores.append(1 if pos > 0 else 0)
+    return matches, scores
+
+  def matchPrefix(self, q, candidates):
+    texts = self.texts
+    substringMatches, substringScores = self.matchSubstring(q, candidates)
+    matches = []
+    scores = []
+    for i in substringMatches:
+      masks, boundaries = self.charMasks(i)
+      text = texts[i]
+      pos = text.find(q)
+      while pos != -1 and not (boundaries >> pos) & 1:
+        pos = text.find(q, pos + 1)
+      if pos != -1:
+        matches.append(i)
+        scores.append(2 if pos == 0 else 1)
+    return matches, scores
+
+  def fuzzyScore(self, i, q):
+    masks, boundaries = self.charMasks(i)
+    n = len(q)
+    # Backward pass: highest position at which each character of the query can be matched
+    # while leaving room for the rest of the query.
+    last = [0] * n
+    limit = len(self.texts[i])
+    for k in range(n - 1, -1, -1):
+      m = masks.get(q[k], 0) & ((1 << limit) - 1)
+      if m == 0:
+        return None
+      limit = m.bit_length() - 1
+      last[k] = limit
+    # Forward pass: for each character, pick the best position among the feasible ones
+    score = 0
+    prev = -1
+    for k in range(n):
+      window = masks[q[k]] & ((1 << (last[k] + 1)) - 1) & ~((1 << (prev + 1)) - 1)
+      if prev >= 0 and (window >> (prev + 1)) & 1:
+        pos = prev + 1
+        score += scoreMatch + bonusConsecutive
+      elif window & boundaries:
+        b = window & boundaries
+        pos = (b & -b).bit_length() - 1
+        score += scoreMatch + bonusBoundary
+      else:
+        pos = (window & -window).bit_length() - 1
+        score += scoreMatch
+      if k == 0:
+        if pos == 0:
+          score += bonusFirstCharacter
+      elif pos > prev + 1:
+        score -= penaltyGapStart + penaltyGapExtension * (pos - prev - 2)
+      prev = pos
+    return score
+
+  def matchFuzzy(self, q, candidates):
+    matches = []
+    scores = []
+    for i in candidates:
+      score = self.fuzzyScore(i, q)
+      if score is not None:
+        matches.append(i)
+        scores.append(score)
+    return matches, scores
+
+  # Indices of the itemGroups which may match the (folded) query, in pre-order
+  def candidates(self, q, mode = 'substring'):
+    # When the query extends a recent one (e.g. while typing "sketch" after "sk"),
+    # only the matches of that query can still match.
+    candidates = None
+    for (cachedMode, cachedQuery), (cachedMatches, cachedScores, cachedRows) in self.cachedQueries.items():
+      if cachedQuery == '':
+        continue # everything matches the empty query, the index can do better than that
+      extends = q.startswith(cachedQuery) if mode == 'prefix' else cachedQuery in q
+      if cachedMode == mode and extends and (candidates is None or len(cachedMatches) < len(candidates)):
+        candidates = cachedMatches
+    if candidates is not None:
+      return candidates
+    if mode == 'fuzzy':
+      # Each character class excludes the next character of the query, so the pattern never backtracks.
+      pattern = re.escape(q[0]) + ''.join('[^\\n' + re.escape(c) + ']*' + re.escape(c) for c in q[1:])
+      return self.scanLines(re.compile(pattern))
+    if self.useTrigrams and len(q) >= 3:
+      import TrigramIndex
+      return TrigramIndex.candidates(self, q)
+    return range(len(self.groups))
+
+  # Those of the candidates which match the (folded) query, and their scores (higher is better)
+  def matchCandidates(self, q, mode, candidates):
+    if mode == 'prefix':
+      return self.matchPrefix(q, candidates)
+    elif mode == 'fuzzy':
+      return self.matchFuzzy(q, candidates)
+    else:
+      return self.matchSubstring(q, candidates)
+
+  # Indices of the itemGroups matching the query, in pre-order, and their scores (higher is better)
+  def matches(self, query, mode = 'substring'):
+    q = fold(query)
+    return self.matchCandidates(q, mode, self.candidates(q, mode))
+
+  def rows(self, matches, scores, everything = False):
+    return RankedRows(self, matches, scores, everything)
+
+  # The returned RankedRows are shared with the cache, only their fetch() method may be called.
+  def search(self, query, mode = 'substring'):
+    job = SearchJob(self, query, mode)
+    while not job.done:
+      job.step(None)
+    return job.rows
+
+  # A new index with additional top-level itemGroups, e.g. the results of the providers which answer
+  # queries themselves (see SearchResults.registerQueryResultProvider). The entries of this index are copied.
+  def extend(self, extraItemGroups):
+    extended = SearchIndex(self.itemGroups + extraItemGroups, self)
+    extended.useTrigrams = self.useTrigrams
+    extended.useFields = self.useFields
+    return extended
+
+  def cacheResults(self, key, matches, scores, rows):
+    self.cachedQueries[key] = (matches, scores, rows)
+    while len(self.cachedQueries) > maxCachedQueries:
+      self.cachedQueries.popitem(last = False)
+
+# A search which can be processed in several time-bounded steps, see SearchScheduler.
+class SearchJob():
+  chunkSize = 500
+
+  def __init__(self, searchIndex, query, mode):
+    self.searchIndex = searchIndex
+    self.query = query
+    self.q = fold(query)
+    self.mode = mode
+    self.key = (mode, self.q)
+    self.matches = []
+    self.scores = []
+    self.rows = None
+    self.done = False
+    self.candidates = None
+    self.position = 0
+    if self.key in searchIndex.cachedQueries:
+      searchIndex.cachedQueries.move_to_end(self.key)
+      self.rows = searchIndex.cachedQueries[self.key][2]
+      self.done = True
+    elif self.q == '':
+      self.matches = list(range(len(searchIndex)))
+      self.scores = [0] * len(self.matches)
+      # Everything matches: the top-level itemGroups and their subtrees are displayed in their original order
+      topLevel = [i for i, group in searchIndex.topLevel]
+      self.finish(searchIndex.rows(topLevel, [0] * len(topLevel), everything = True))
+
+  def finish(self, rows):
+    self.rows = rows
+    self.done = True
+    self.searchIndex.cacheResults(self.key, self.matches, self.scores, rows)
+
+  # Processes chunks of candidates until the deadline (a time.perf_counter() value, or None to process a single chunk)
+  def step(self, deadline):
+    if self.done:
+      return
+    # Computing the candidates, and the rows once all of them have been matched, are separate steps
+    if self.candidates is None:
+      self.candidates = self.searchIndex.candidates(self.q, self.mode)
+      return
+    while self.position < len(self.candidates):
+      chunk = self.candidates[self.position : self.position + self.chunkSize]
+      self.position += self.chunkSize
+      matches, scores = self.searchIndex.matchCandidates(self.q, self.mode, chunk)
+      self.matches.extend(matches)
+      self.scores.extend(scores)
+      if deadline is None or time.perf_counter() >= deadline:
+        return
+    if self.searchIndex.useFields:
+      self.addFieldMatches()
+    self.finish(self.searchIndex.rows(self.matches, self.scores))
+
+  # Adds the itemGroups found through their other fields (see FieldIndex), keeping the matches in pre-order
+  def addFieldMatches(self):
+    import FieldIndex
+    fieldMatches = FieldIndex.matches(self.searchIndex, self.q)
+    if len(fieldMatches) == 0:
+      return
+    for i, score in zip(self.matches, self.scores):
+      fieldMatches[i] = score
+    self.matches = sorted(fieldMatches)
+    self.scores = [fieldMatches[i] for i in self.matches]
+
+  # Rows for the matches found so far
+  def partialRows(self):
+    return self.searchIndex.rows(self.matches, self.scores)
+
+# Rows to display for the given matches: if an itemGroup matches, its entire subtree is included
+# (might need to disable this if it causes too much noise), along with its ancestors.
+# The subtrees of the collapsed itemGroups are not included, but their matching descendants are.
+# Siblings are sorted by the best score in their subtree, ties keep the original order.
+# Only the rows which are displayed are materialized: the siblings are ranked with a heap,
+# and fetch() walks the tree until enough rows are available, so that a short query which matches
+# thousands of itemGroups costs about the same as a long one.
+class RankedRows():
+  # everything is True when all the itemGroups match (the empty query), matches then only contains the top-level ones
+  def __init__(self, searchIndex, matches, scores, everything = False):
+    self.searchIndex = searchIndex
+    self.matches = matches
+    self.everything = everything
+    best = {}      # displayed itemGroup -> best score in its subtree
+    children = {}  # displayed itemGroup (or -1 for the root) -> displayed children
+    blocks = set() # matched itemGroups displayed along with their entire subtree
+    parents = searchIndex.parents
+    subtreeEnds = searchIndex.subtreeEnds
+    end = 0
+    for i, score in zip(matches, scores):
+      if i >= end:
+        if not searchIndex.isCollapsed(i):
+          blocks.add(i)
+          end = subtreeEnds[i]
+        node = i
+        while node != -1 and node not in best:
+          best[node] = score
+          children.setdefault(parents[node], []).append(node)
+          node = parents[node]
+      # Matches inside the subtree of another match also raise the rank of their displayed ancestors
+      node = i
+      while node != -1:
+        if node in best:
+          if best[node] >= score:
+            break
+          best[node] = score
+        node = parents[node]
+    self.best = best
+    self.children = children
+    self.blocks = blocks
+    self.total = len(best) - len(blocks) + sum(searchIndex.blockSize(i) for i in blocks) # number of rows
+    self.rows = [] # the rows fetched so far, in display order
+    self.pending = self.walk(children.get(-1, []))
+
+  def __len__(self):
+    return self.total
+
+  # Yields the rows of the given siblings and of their displayed descendants, by ranges
+  def walk(self, siblings):
+    heap = [(-self.best[node], node) for node in siblings]
+    heapq.heapify(heap)
+    while len(heap) > 0:
+      negativeScore, node = heapq.heappop(heap)
+      if node in self.blocks:
+        yield from self.searchIndex.blockRanges(node)
+      else:
+        yield (node,)
+        yield from self.walk(self.children.get(node, []))
+
+  # Makes sure that the first count rows (or all the rows if there are fewer) are in self.rows, returns their number.
+  # self.rows may contain more rows than requested.
+  def fetch(self, count):
+    while len(self.rows) < count and self.pending is not None:
+      rows = next(self.pending, None)
+      if rows is None:
+        self.pending = None
+      else:
+        self.rows.extend(rows)
+    return min(count, len(self.rows))
+
+  def all(self):
+    self.fetch(self.total)
+    return self.rows
+
+  # Number of the descendants of the itemGroup at index i which match, found by bisecting the matches (in pre-order)
+  def subtreeMatches(self, i):
+    end = self.searchIndex.subtreeEnds[i]
+    if self.everything:
+      return end - i - 1
+    return bisect_left(self.matches, end) - bisect_right(self.matches, i)
+
+# RankedRows followed by rows which are not ranked (e.g. the results of the providers which answer queries themselves,
+# see SearchIndex.extend), with the same interface.
+class AppendedRows():
+  def __init__(self, rankedRows, extraRows):
+    self.rankedRows = rankedRows
+    self.extraRows = list(extraRows)
+    self.total = len(rankedRows) + len(self.extraRows)
+    self.rows = []
+
+  def __len__(self):
+    return self.total
+
+  def fetch(self, count):
+    nbRanked = len(self.rankedRows)
+    if len(self.rows) < min(count, nbRanked):
+      self.rankedRows.fetch(count)
+      self.rows.extend(self.rankedRows.rows[len(self.rows) : min(len(self.rankedRows.rows), nbRanked)])
+    if count > nbRanked and len(self.rows) >= nbRanked:
+      self.rows.extend(self.extraRows[len(self.rows) - nbRanked : count - nbRanked])
+    return min(count, len(self.rows))
+
+  def all(self):
+    self.fetch(self.total)
+    return self.rows
+
+  def subtreeMatches(self, i):
+    return self.rankedRows.subtreeMatches(i) if i < len(self.rankedRows.searchIndex) else 0
@@ -2,13 +2,51 @@ actionHandlers = { }
 toolTipHandlers = { }
 resultProvidersCached = { }
 resultProvidersUncached = { }
+resultProvidersCachedPerWorkbench = { }
+cachedStamps = { }
+uncachedVersions = { }
+resultProvidersStreaming = { }
+resultProvidersForQuery = { }
 
 # name : string
 # getItemGroupsCached: () -> [itemGroup]
 # getItemGroupsUncached: () -> [itemGroup]
-def registerResultProvider(name, getItemGroupsCached, getItemGroupsUncached):
+# getCachedStamp: () -> JSON-serializable value, the cached results are harvested again when it changes (optional)
+# getUncachedVersion: () -> comparable value, getItemGroupsUncached is only called again when it changes (optional,
+#                     by default it is called each time the search box gains focus)
+def registerResultProvider(name, getItemGroupsCached, getItemGroupsUncached, getCachedStamp = None, getUncachedVersion = None):
   resultProvidersCached[name] = getItemGroupsCached
   resultProvidersUncached[name] = getItemGroupsUncached
+  if getCachedStamp is not None:
+    cachedStamps[name] = getCachedStamp
+  if getUncachedVersion is not None:
+    uncachedVersions[name] = getUncachedVersion
+
+# Registers a provider whose results are not cached, and which yields them progressively (see StreamingResults).
+# It is restarted each time the search box gains focus, its results are added to the list as they arrive.
+# name : string
+# getItemGroups: cancellationToken -> iterable of itemGroup or [itemGroup], usually a generator. It can yield None
+#                to give control back to the GUI while it waits for something. It should stop as soon as
+#                cancellationToken.isCancelled() returns True (the provider was restarted, or its time budget is exceeded).
+# timeBudget: number of seconds after which the provider is cancelled
+def registerStreamingResultProvider(name, getItemGroups, timeBudget = 2.0):
+  resultProvidersStreaming[name] = (getItemGroups, timeBudget)
+
+# Registers a provider which answers the queries itself, e.g. using its own index, instead of listing all of its
+# results up front. It is called (on the GUI thread) once the user stops typing, and its results are displayed after
+# the other ones, in the order in which they are returned.
+# name : string
+# getItemGroupsForQuery: (query, limit) -> [itemGroup], at most limit itemGroups matching the query
+def registerQueryResultProvider(name, getItemGroupsForQuery):
+  resultProvidersForQuery[name] = getItemGroupsForQuery
+
+# Allows the cache to store the results of an already-registered provider as one shard per workbench,
+# so that installing or updating a workbench only harvests the results of that workbench again.
+# name : string, the name of the provider registered with registerResultProvider
+# getItemGroupsForWorkbench: workbenchName -> [itemGroup], or None if they can't be obtained without loading the workbench
+# mergeItemGroups: [[itemGroup]] -> [itemGroup], combines the results of all workbenches
+def registerCachedPerWorkbench(name, getItemGroupsForWorkbench, mergeItemGroups):
+  resultProvidersCachedPerWorkbench[name] = (getItemGroupsForWorkbench, mergeItemGroups)
 
 # name : str
 # action : act -> None
@@ -0,0 +1,85 @@
+from PySide import QtCore
+import time
+import SearchIndex
+import Instrumentation
+
+# Runs the searches of the SearchBox on the GUI thread, without blocking it:
+#  * the keystrokes typed in quick succession are coalesced into a single search,
+#  * the index is scanned in time-bounded slices, the event loop runs between two slices,
+#  * each search is tagged with a generation number, a new search abandons the previous one,
+#  * partial results are published as soon as they fill the first screen, then the final results.
+# Running on the GUI thread avoids sharing the index (and its cache of recent queries) with a worker thread.
+class SearchScheduler(QtCore.QObject):
+  results = QtCore.Signal(object, object, bool, int) # searchIndex, rows, final, generation
+
+  coalesceInterval = 30 # ms
+  sliceDuration = 0.010 # s
+
+  def __init__(self, firstScreenful = 20):
+    super(SearchScheduler, self).__init__()
+    self.firstScreenful = firstScreenful
+    self.generation = 0
+    self.job = None
+    self.jobTime = 0.0 # time spent in the slices of the current job
+    self.publishedPartial = False
+    # Optional (searchIndex, query, mode, rows) -> (searchIndex, rows), adds results to the final ones
+    self.pushDown = None
+    self.coalesceTimer = QtCore.QTimer()
+    self.coalesceTimer.setSingleShot(True)
+    self.coalesceTimer.setInterval(self.coalesceInterval)
+    self.coalesceTimer.timeout.connect(self.runSlice)
+    self.sliceTimer = QtCore.QTimer()
+    self.sliceTimer.setSingleShot(True)
+    self.sliceTimer.setInterval(0)
+    self.sliceTimer.timeout.connect(self.runSlice)
+
+  # Returns the generation of the search. Queries which are already cached are published immediately,
+  # the others after a short delay, unless immediate is True.
+  def schedule(self, searchIndex, query, mode, immediate = False):
+    self.cancel()
+    self.generation += 1
+    start = time.perf_counter()
+    job = SearchIndex.SearchJob(searchIndex, query, mode)
+    self.jobTime = time.perf_counter() - start
+    if job.done:
+      Instrumentation.record('search/cached', self.jobTime)
+      self.publishFinal(job)
+    else:
+      self.job = job
+      if immediate:
+        self.runSlice()
+      else:
+        self.coalesceTimer.start()
+    return self.generation
+
+  def cancel(self):
+    self.coalesceTimer.stop()
+    self.sliceTimer.stop()
+    self.job = None
+    self.publishedPartial = False
+
+  def isRunning(self):
+    return self.job is not None
+
+  def runSlice(self):
+    job = self.job
+    if job is None:
+      return
+    start = time.perf_counter()
+    job.step(start + self.sliceDuration)
+    self.jobTime += time.perf_counter() - start
+    if job.done:
+      self.job = None
+      Instrumentation.record('search/' + job.mode, self.jobTime, len(job.rows))
+      self.publishFinal(job)
+      return
+    if not self.publishedPartial and len(job.matches) >= self.firstScreenful:
+      self.publishedPartial = True
+      self.results.emit(job.searchIndex, job.partialRows(), False, self.generation)
+    self.sliceTimer.start()
+
+  def publishFinal(self, job):
+    searchIndex, rows = job.searchIndex, job.rows
+    if self.pushDown is not None and job.q != '':
+      searchIndex, rows = self.pushDown(searchIndex, job.query, job.mode, rows)
+    self.results.emit(searchIndex, rows, True, self.generation)
@@ -1,6 +1,10 @@
 from PySide import QtCore
 from PySide import QtGui
+import hashlib
 import json
+import mmap
+import os
+import struct
 
 def iconToBase64(icon, sz = QtCore.QSize(64,64), mode = QtGui.QIcon.Mode.Normal, state = QtGui.QIcon.State.On):
   buf = QtCore.QBuffer()
@@ -9,79 +13,252 @@ def iconToBase64(icon, sz = QtCore.QSize(64,64), mode = QtGui.QIcon.Mode.Normal,
   return QtCore.QTextCodec.codecForName('UTF-8').toUnicode(buf.data().toBase64())
 
 def iconToHTML(icon, sz = 12, mode = QtGui.QIcon.Mode.Normal, state = QtGui.QIcon.State.On):
+  import IconCache
+  icon = IconCache.getIcon(icon)
   return '<img width="'+str(sz)+'" height="'+str(sz)+'" src="data:image/png;base64,' + iconToBase64(icon, QtCore.QSize(sz,sz), mode, state) + '" />'
 
+# The order of these lists is part of the icon atlas format, only append to them.
+iconModes = [QtGui.QIcon.Mode.Normal, QtGui.QIcon.Mode.Disabled, QtGui.QIcon.Mode.Active, QtGui.QIcon.Mode.Selected]
+iconStates = [QtGui.QIcon.State.Off, QtGui.QIcon.State.On]
+
+def iconToPNG(icon, sz, mode, state):
+  buf = QtCore.QBuffer()
+  buf.open(QtCore.QIODevice.WriteOnly)
+  icon.pixmap(sz, mode, state).save(buf, 'PNG')
+  return bytes(buf.data())
+
+# An icon blob contains all the sizes × modes × states of an icon:
+# count, then for each pixmap: width, height, mode, state, PNG length, PNG data
 def serializeIcon(icon):
-  iconPixmaps = {}
+  pixmaps = []
   for sz in icon.availableSizes():
-    strW = str(sz.width())
-    strH = str(sz.height())
-    iconPixmaps[strW] = {}
-    iconPixmaps[strW][strH] = {}
-    for strMode, mode in {'normal':QtGui.QIcon.Mode.Normal, 'disabled':QtGui.QIcon.Mode.Disabled, 'active':QtGui.QIcon.Mode.Active, 'selected':QtGui.QIcon.Mode.Selected}.items():
-      iconPixmaps[strW][strH][strMode] = {}
-      for strState, state in {'off':QtGui.QIcon.State.Off, 'on':QtGui.QIcon.State.On}.items():
-        iconPixmaps[strW][strH][strMode][strState] = iconToBase64(icon, sz, mode, state)
-  return iconPixmaps
-
-# workbenches is a list(str), toolbar is a str, text is a str, icon is a QtGui.QIcon
-def serializeTool(tool):
+    for mode in iconModes:
+      for state in iconStates:
+        png = iconToPNG(icon, sz, mode, state)
+        pixmaps.append(struct.pack('<HHBBI', sz.width(), sz.height(), iconModes.index(mode), iconStates.index(state), len(png)) + png)
+  return struct.pack('<I', len(pixmaps)) + b''.join(pixmaps)
+
+# Decoding the PNGs into QImages is thread-safe, so it can be done on a worker thread, see CacheLoader.
+def deserializeIconImages(blob):
+  images = []
+  count, = struct.unpack_from('<I', blob, 0)
+  offset = 4
+  for i in range(count):
+    w, h, mode, state, length = struct.unpack_from('<HHBBI', blob, offset)
+    offset += 10
+    img = QtGui.QImage()
+    img.loadFromData(QtCore.QByteArray(bytes(blob[offset:offset+length])))
+    offset += length
+    images.append((img, mode, state))
+  return images
+
+# Creating QPixmaps must happen on the GUI thread.
+def iconFromImages(images):
+  ico = QtGui.QIcon()
+  for img, mode, state in images:
+    ico.addPixmap(QtGui.QPixmap.fromImage(img), iconModes[mode], iconStates[state])
+  return ico
+
+def deserializeIcon(blob):
+  return iconFromImages(deserializeIconImages(blob))
+
+# Stores each distinct icon once, keyed by a hash of its pixels (or of its reference, see IconCache.IconReference).
+# Item records only hold the icon's index.
+class IconAtlas():
+  def __init__(self):
+    self.blobs = {} # icon id -> (kind, icon blob), in insertion order
+    self.indices = {} # icon id -> index in the icon section
+    self.idsByCacheKey = {} # avoids rasterizing the same QIcon instance twice
+  def add(self, icon):
+    import IconCache
+    if icon is None:
+      return None
+    if isinstance(icon, IconCache.IconReference):
+      kind = 1 + IconCache.iconReferenceKinds.index(icon.kind)
+      blob = icon.value.encode('utf-8')
+      iconId = hashlib.sha1(icon.iconId.encode('utf-8')).hexdigest()
+    elif isinstance(icon, IconCache.IconHandle):
+      # Already serialized, e.g. when item groups read from the cache are written again
+      kind = 0
+      blob = icon.blob
+      iconId = icon.iconId
+    else:
+      cacheKey = icon.cacheKey()
+      if cacheKey in self.idsByCacheKey:
+        return self.idsByCacheKey[cacheKey]
+      kind = 0
+      blob = serializeIcon(icon)
+      iconId = hashlib.sha1(blob).hexdigest()
+      self.idsByCacheKey[cacheKey] = iconId
+    if iconId not in self.blobs:
+      self.indices[iconId] = len(self.blobs)
+      self.blobs[iconId] = (kind, blob)
+    return iconId
+  def index(self, iconId):
+    return -1 if iconId is None else self.indices[iconId]
+
+# workbenches is a list(str), toolbar is a str, text is a str, icon is a QtGui.QIcon or IconCache.IconReference (serialized) or an IconCache.IconHandle (deserialized)
+def serializeTool(tool, atlas):
   return {
     'workbenches': tool['workbenches'],
     'toolbar': tool['toolbar'],
     'text': tool['text'],
     'toolTip': tool['toolTip'],
-    'icon': serializeIcon(tool['icon']),
+    'icon': atlas.add(tool['icon']),
   }
 
-def deserializeIcon(iconPixmaps):
-  ico = QtGui.QIcon()
-  for strW, wPixmaps in iconPixmaps.items():
-    for strH, hPixmaps in wPixmaps.items():
-      for strMode, modePixmaps in hPixmaps.items():
-        mode = {'normal':QtGui.QIcon.Mode.Normal, 'disabled':QtGui.QIcon.Mode.Disabled, 'active':QtGui.QIcon.Mode.Active, 'selected':QtGui.QIcon.Mode.Selected}[strMode]
-        for strState, statePixmap in modePixmaps.items():
-          state = {'off':QtGui.QIcon.State.Off, 'on':QtGui.QIcon.State.On}[strState]
-          pxm = QtGui.QPixmap()
-          pxm.loadFromData(QtCore.QByteArray.fromBase64(QtCore.QTextCodec.codecForName('UTF-8').fromUnicode(statePixmap)))
-          ico.addPixmap(pxm, mode, state)
-  return ico
-
-def deserializeTool(tool):
+def deserializeTool(tool, icons):
   return {
     'workbenches': tool['workbenches'],
     'toolbar': tool['toolbar'],
     'text': tool['text'],
     'toolTip': tool['toolTip'],
-    'icon': deserializeIcon(tool['icon']),
+    'icon': icons.get(tool['icon']),
   }
 
-def serializeItemGroup(itemGroup):
-  return {
-    'icon': serializeIcon(itemGroup['icon']),
-    'text': itemGroup['text'],
-    'toolTip': itemGroup['toolTip'],
-    'action': itemGroup['action'],
-    'subitems': serializeItemGroups(itemGroup['subitems'])
-  }
+# Binary cache format, all integers are little-endian:
+#   header:       magic, format version, unused, number of strings, records and icons, offsets of the three tables
+#   string table: (offset, length) of each string, followed by the UTF-8 data. Strings are deduplicated.
+#   record table: one fixed-width record per item, in pre-order:
+#                 text string, toolTip string (JSON), action string (JSON), icon index or -1, number of direct subitems
+#   icon section: (sha1, offset, length, kind) of each icon blob, followed by the blobs. The kind is 0 for pixels
+#                 (see serializeIcon), otherwise 1 + the index in IconCache.iconReferenceKinds of a UTF-8 reference.
+# Increment cacheFormatVersion whenever this layout or the contents of the records change.
+cacheMagic = b'SBMC'
+cacheFormatVersion = 2
+headerFormat = struct.Struct('<4sHHIIIIII')
+stringEntryFormat = struct.Struct('<II')
+recordFormat = struct.Struct('<IIIiI')
+iconEntryFormat = struct.Struct('<20sIIB')
 
-def serializeItemGroups(itemGroups):
-  return [serializeItemGroup(itemGroup) for itemGroup in itemGroups]
+class CacheFormatError(Exception):
+  pass
 
 def serialize(itemGroups):
-  return json.dumps(serializeItemGroups(itemGroups))
+  atlas = IconAtlas()
+  strings = {} # str -> index, in insertion order
+  def stringIndex(s):
+    if s not in strings:
+      strings[s] = len(strings)
+    return strings[s]
+  records = []
+  def serializeItemGroup(itemGroup):
+    records.append(recordFormat.pack(stringIndex(itemGroup['text']),
+                                     stringIndex(json.dumps(itemGroup['toolTip'])),
+                                     stringIndex(json.dumps(itemGroup['action'])),
+                                     atlas.index(atlas.add(itemGroup['icon'])),
+                                     len(itemGroup['subitems'])))
+    for subitem in itemGroup['subitems']:
+      serializeItemGroup(subitem)
+  for itemGroup in itemGroups:
+    serializeItemGroup(itemGroup)
 
-def deserializeItemGroup(itemGroup):
-  return {
-    'icon': deserializeIcon(itemGroup['icon']),
-    'text': itemGroup['text'],
-    'toolTip': itemGroup['toolTip'],
-    'action': itemGroup['action'],
-    'subitems': deserializeItemGroups(itemGroup['subitems'])
-  }
+  encodedStrings = [s.encode('utf-8') for s in strings]
+  stringEntries = []
+  offset = 0
+  for encoded in encodedStrings:
+    stringEntries.append(stringEntryFormat.pack(offset, len(encoded)))
+    offset += len(encoded)
+  stringTable = b''.join(stringEntries) + b''.join(encodedStrings)
+
+  iconEntries = []
+  offset = 0
+  for iconId, (kind, blob) in atlas.blobs.items():
+    iconEntries.append(iconEntryFormat.pack(bytes.fromhex(iconId), offset, len(blob), kind))
+    offset += len(blob)
+  iconSection = b''.join(iconEntries) + b''.join(blob for kind, blob in atlas.blobs.values())
+
+  recordTable = b''.join(records)
+  stringsOffset = headerFormat.size
+  recordsOffset = stringsOffset + len(stringTable)
+  iconsOffset = recordsOffset + len(recordTable)
+  header = headerFormat.pack(cacheMagic, cacheFormatVersion, 0, len(strings), len(records), len(atlas.blobs), stringsOffset, recordsOffset, iconsOffset)
+  return header + stringTable + recordTable + iconSection
+
+# data can be bytes or a memory-mapped file, the records are decoded in a single pass
+# without building an intermediate representation of the whole tree.
+# The header is checked before any view of data is taken, and the views are released before an error is raised,
+# so that a memory-mapped file can always be closed (and rewritten) when its shard is stale or corrupted.
+def deserialize(data):
+  if len(data) < headerFormat.size:
+    raise CacheFormatError('Truncated SearchBar cache')
+  header = headerFormat.unpack_from(data, 0)
+  magic, version, unused, nbStrings, nbRecords, nbIcons, stringsOffset, recordsOffset, iconsOffset = header
+  if magic != cacheMagic:
+    raise CacheFormatError('Not a SearchBar cache')
+  if version != cacheFormatVersion:
+    raise CacheFormatError('SearchBar cache has format version ' + str(version) + ', expected ' + str(cacheFormatVersion))
+  if stringsOffset + nbStrings * stringEntryFormat.size > recordsOffset \
+     or recordsOffset + nbRecords * recordFormat.size > iconsOffset \
+     or iconsOffset + nbIcons * iconEntryFormat.size > len(data):
+    raise CacheFormatError('Truncated SearchBar cache')
+  error = None
+  view = memoryview(data)
+  try:
+    return deserializeSections(view, header)
+  except CacheFormatError as e:
+    # Raised again below, once the traceback (which references the views) is gone
+    error = str(e)
+  except (struct.error, ValueError, IndexError) as e:
+    error = 'Corrupted SearchBar cache (' + str(e) + ')'
+  finally:
+    view.release()
+  raise CacheFormatError(error)
+
+def deserializeSections(data, header):
+  import IconCache
+  magic, version, unused, nbStrings, nbRecords, nbIcons, stringsOffset, recordsOffset, iconsOffset = header
+  stringData = stringsOffset + nbStrings * stringEntryFormat.size
+  strings = [None] * nbStrings
+  def getString(i):
+    s = strings[i]
+    if s is None:
+      offset, length = stringEntryFormat.unpack_from(data, stringsOffset + i * stringEntryFormat.size)
+      if stringData + offset + length > recordsOffset:
+        raise CacheFormatError('Truncated SearchBar cache')
+      s = str(data[stringData + offset : stringData + offset + length], 'utf-8')
+      strings[i] = s
+    return s
+
+  # The icon blobs are copied out of the file (without decoding them), so that the file is not kept
+  # mapped, which would prevent it from being rewritten on some platforms.
+  blobData = iconsOffset + nbIcons * iconEntryFormat.size
+  icons = []
+  for digest, offset, length, kind in iconEntryFormat.iter_unpack(data[iconsOffset : blobData]):
+    if blobData + offset + length > len(data):
+      raise CacheFormatError('Truncated SearchBar cache')
+    blob = bytes(data[blobData + offset : blobData + offset + length])
+    if kind == 0:
+      icons.append(IconCache.IconHandle(digest.hex(), blob))
+    else:
+      icons.append(IconCache.IconReference(IconCache.iconReferenceKinds[kind - 1], str(blob, 'utf-8')))
 
-def deserializeItemGroups(serializedItemGroups):
-  return [deserializeItemGroup(itemGroup) for itemGroup in serializedItemGroups]
+  itemGroups = []
+  stack = [] # (subitems list, number of subitems still expected)
+  for text, toolTip, action, icon, nbSubitems in recordFormat.iter_unpack(data[recordsOffset : recordsOffset + nbRecords * recordFormat.size]):
+    itemGroup = {
+      'icon': icons[icon] if icon >= 0 else None,
+      'text': getString(text),
+      'toolTip': json.loads(getString(toolTip)),
+      'action': json.loads(getString(action)),
+      'subitems': []
+    }
+    if len(stack) == 0:
+      itemGroups.append(itemGroup)
+    else:
+      stack[-1][0].append(itemGroup)
+      stack[-1][1] -= 1
+    if nbSubitems > 0:
+      stack.append([itemGroup['subitems'], nbSubitems])
+    while len(stack) > 0 and stack[-1][1] == 0:
+      stack.pop()
+  if len(stack) > 0:
+    raise CacheFormatError('Truncated SearchBar cache')
+  return itemGroups
 
-def deserialize(serializedItemGroups):
-  return deserializeItemGroups(json.loads(serializedItemGroups))
+def deserializeFile(path):
+  with open(path, 'rb') as f:
+    if os.fstat(f.fileno()).st_size == 0:
+      raise CacheFormatError('Empty SearchBar cache')
+    with mmap.mmap(f.fileno(), 0, access = mmap.ACCESS_READ) as mapped:
+      return deserialize(mapped)
@@ -0,0 +1,119 @@
+import time
+from PySide import QtCore
+
+# Runs the providers registered with SearchResults.registerStreamingResultProvider. Each provider is a generator
+# which is resumed on the GUI thread in short time slices, so that a slow provider does not block the search box:
+# the itemGroups it yields are merged into the results as they arrive (see GetItemGroups).
+# A provider is restarted each time the search box gains focus, the previous run is then cancelled.
+
+class CancellationToken():
+  def __init__(self, timeBudget):
+    self.cancelled = False
+    self.deadline = time.perf_counter() + timeBudget
+
+  def cancel(self):
+    self.cancelled = True
+
+  # Providers should check this regularly, and stop when it returns True:
+  # the run was cancelled, or the provider has exceeded its time budget.
+  def isCancelled(self):
+    return self.cancelled or time.perf_counter() > self.deadline
+
+  def remainingTime(self):
+    return max(0, self.deadline - time.perf_counter())
+
+class ResultStream(QtCore.QObject):
+  sliceDuration = 0.010 # s
+  pollInterval = 20 # ms, when the provider yields None because it is waiting for something
+
+  def __init__(self, name, getItemGroups, timeBudget):
+    super(ResultStream, self).__init__()
+    self.name = name
+    self.getItemGroups = getItemGroups
+    self.timeBudget = timeBudget
+    self.token = None
+    self.iterator = None
+    self.itemGroups = []
+    self.timer = QtCore.QTimer()
+    self.timer.setSingleShot(True)
+    self.timer.timeout.connect(self.runSlice)
+
+  def start(self):
+    self.cancel()
+    self.itemGroups = []
+    self.token = CancellationToken(self.timeBudget)
+    try:
+      self.iterator = iter(self.getItemGroups(self.token))
+    except Exception as e:
+      print('SearchBox: the ' + self.name + ' result provider failed (' + str(e) + ')')
+      return
+    self.timer.start(0)
+
+  def cancel(self):
+    self.timer.stop()
+    if self.token is not None:
+      self.token.cancel()
+    if self.iterator is not None and hasattr(self.iterator, 'close'):
+      try:
+        self.iterator.close()
+      except:
+        pass
+    self.iterator = None
+
+  def isRunning(self):
+    return self.iterator is not None
+
+  def runSlice(self):
+    if self.iterator is None:
+      return
+    deadline = time.perf_counter() + self.sliceDuration
+    batch = []
+    waiting = False
+    while time.perf_counter() < deadline:
+      if self.token.isCancelled():
+        print('SearchBox: the ' + self.name + ' result provider exceeded its time budget of ' + str(self.timeBudget) + 's, its results are incomplete.')
+        self.cancel()
+        break
+      try:
+        item = next(self.iterator)
+      except StopIteration:
+        self.iterator = None
+        break
+      except Exception as e:
+        print('SearchBox: the ' + self.name + ' result provider failed (' + str(e) + ')')
+        self.iterator = None
+        break
+      if item is None:
+        waiting = True
+        break
+      elif isinstance(item, list):
+        batch.extend(item)
+      else:
+        batch.append(item)
+    if len(batch) > 0:
+      # A new list, so that GetItemGroups notices the change
+      self.itemGroups = self.itemGroups + batch
+      notifier.progress.emit()
+    if self.iterator is not None:
+      self.timer.start(self.pollInterval if waiting else 0)
+
+class Notifier(QtCore.QObject):
+  progress = QtCore.Signal() # new results have arrived
+
+notifier = Notifier()
+streams = {} # provider name -> ResultStream
+
+def getStream(name):
+  import SearchResults
+  getItemGroups, timeBudget = SearchResults.resultProvidersStreaming[name]
+  if name not in streams:
+    streams[name] = ResultStream(name, getItemGroups, timeBudget)
+  return streams[name]
+
+def restartAll():
+  import SearchResults
+  for name in SearchResults.resultProvidersStreaming:
+    getStream(name).start()
+
+def itemGroups(name):
+  return getStream(name).itemGroups
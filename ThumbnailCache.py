@@ -0,0 +1,191 @@
+import hashlib
+import os
+import zipfile
+from collections import OrderedDict
+from PySide import QtCore
+from PySide import QtGui
+
+# Preview images (PNG data) of the results, e.g. document objects rendered offscreen, kept in an in-memory LRU
+# and, for those whose key stays valid across sessions, in an on-disk LRU in the cache directory.
+# Rendering is deferred until the selection has stayed on a result for a moment, and only the last request
+# is rendered, so that scrolling through the results never waits for a 3D render.
+
+maxMemoryEntries = 128
+maxDiskBytes = 32 * 1024 * 1024
+renderDelay = 150 # ms
+thumbnailWidth = 256
+thumbnailHeight = 192
+
+memoryCache = OrderedDict() # key -> PNG data, least recently used first
+writesSincePrune = None # None until the disk cache has been pruned once in this session
+pruneInterval = 32 # number of writes between two prunes of the disk cache
+
+def thumbnailDir():
+  import RefreshTools
+  return os.path.join(RefreshTools.cacheDir(), 'thumbnails')
+
+def diskPath(key):
+  return os.path.join(thumbnailDir(), hashlib.sha1(repr(key).encode('utf-8')).hexdigest() + '.png')
+
+def cacheInMemory(key, png):
+  memoryCache[key] = png
+  memoryCache.move_to_end(key)
+  while len(memoryCache) > maxMemoryEntries:
+    memoryCache.popitem(last = False)
+
+# Returns the cached PNG data, or None. persistent keys are also looked up on disk.
+def get(key, persistent):
+  if key in memoryCache:
+    memoryCache.move_to_end(key)
+    return memoryCache[key]
+  if persistent:
+    path = diskPath(key)
+    try:
+      with open(path, 'rb') as f:
+        png = f.read()
+      os.utime(path) # the modification time orders the disk LRU
+    except:
+      return None
+    cacheInMemory(key, png)
+    return png
+  return None
+
+def put(key, persistent, png):
+  global writesSincePrune
+  cacheInMemory(key, png)
+  if not persistent:
+    return
+  try:
+    os.makedirs(thumbnailDir(), exist_ok = True)
+    path = diskPath(key)
+    with open(path + '.tmp', 'wb') as f:
+      f.write(png)
+    os.replace(path + '.tmp', path)
+  except Exception as e:
+    print('SearchBox: could not write the thumbnail cache (' + str(e) + ')')
+    return
+  if writesSincePrune is None or writesSincePrune >= pruneInterval:
+    pruneDisk()
+    writesSincePrune = 0
+  writesSincePrune += 1
+
+# Removes the least recently used thumbnails until the disk cache fits in maxDiskBytes
+def pruneDisk():
+  try:
+    entries = []
+    for entry in os.scandir(thumbnailDir()):
+      if entry.is_file():
+        stat = entry.stat()
+        entries.append((stat.st_mtime, stat.st_size, entry.path))
+  except:
+    return
+  total = sum(size for mtime, size, path in entries)
+  for mtime, size, path in sorted(entries):
+    if total <= maxDiskBytes:
+      break
+    try:
+      os.remove(path)
+      total -= size
+    except:
+      pass
+
+class Renderer(QtCore.QObject):
+  def __init__(self):
+    super(Renderer, self).__init__()
+    self.pending = None # (key, persistent, render, callback) of the last request
+    self.timer = QtCore.QTimer()
+    self.timer.setSingleShot(True)
+    self.timer.setInterval(renderDelay)
+    self.timer.timeout.connect(self.renderPending)
+
+  def request(self, key, persistent, render, callback):
+    self.pending = (key, persistent, render, callback)
+    self.timer.start()
+
+  def renderPending(self):
+    if self.pending is None:
+      return
+    key, persistent, render, callback = self.pending
+    self.pending = None
+    png = get(key, persistent)
+    if png is None:
+      import Instrumentation
+      with Instrumentation.measure('thumbnail/render'):
+        try:
+          png = render()
+        except Exception as e:
+          print('SearchBox: could not render a preview (' + str(e) + ')')
+          png = None
+      if png is None:
+        png = b'' # remembered as "no preview", so that it is not rendered again
+      put(key, persistent and png != b'', png)
+    callback(png or None)
+
+renderer = None
+
+# Calls callback with the PNG data (or None if there is no preview): immediately if it is cached,
+# otherwise once render() (a function returning PNG data or None) has run, unless another thumbnail
+# is requested in the meantime.
+def request(key, persistent, render, callback):
+  global renderer
+  png = get(key, persistent)
+  if png is not None:
+    callback(png or None)
+    return
+  if renderer is None:
+    renderer = Renderer()
+  renderer.request(key, persistent, render, callback)
+
+# The thumbnail which FreeCAD embeds in a .FCStd file when it saves it (if enabled in its preferences), or None.
+# It is read without extracting the archive, and cached by path and modification time.
+def fcstdThumbnail(path):
+  try:
+    mtime = os.stat(path).st_mtime_ns
+  except:
+    return None
+  key = ('fcstd', path, mtime)
+  png = get(key, False)
+  if png is None:
+    try:
+      with zipfile.ZipFile(path) as archive:
+        png = archive.read('thumbnails/Thumbnail.png')
+    except:
+      png = b'' # no thumbnail
+    put(key, False, png)
+  return png or None
+
+def imageToPNG(image):
+  buf = QtCore.QBuffer()
+  buf.open(QtCore.QIODevice.WriteOnly)
+  image.save(buf, 'PNG')
+  return bytes(buf.data())
+
+# Orientation of FreeCAD's isometric view
+isometricRotation = (0.424708, 0.17592, 0.339851, 0.820473)
+
+# Renders a Coin scene graph (e.g. the RootNode of a view provider) offscreen, without a 3D view, returns PNG data.
+def renderSceneGraph(node, width = thumbnailWidth, height = thumbnailHeight):
+  from pivy import coin
+  viewport = coin.SbViewportRegion(width, height)
+  root = coin.SoSeparator()
+  camera = coin.SoOrthographicCamera()
+  camera.orientation.setValue(coin.SbRotation(*isometricRotation))
+  root.addChild(camera)
+  # A headlight: the default direction of the light, rotated like the camera
+  headlight = coin.SoTransformSeparator()
+  rotation = coin.SoRotation()
+  rotation.rotation.setValue(coin.SbRotation(*isometricRotation))
+  headlight.addChild(rotation)
+  headlight.addChild(coin.SoDirectionalLight())
+  root.addChild(headlight)
+  root.addChild(node)
+  camera.viewAll(root, viewport)
+  offscreenRenderer = coin.SoOffscreenRenderer(viewport)
+  offscreenRenderer.setComponents(coin.SoOffscreenRenderer.RGB)
+  offscreenRenderer.setBackgroundColor(coin.SbColor(1, 1, 1))
+  if not offscreenRenderer.render(root):
+    return None
+  buf = offscreenRenderer.getBuffer()
+  # Coin's buffer starts with the bottom row
+  image = QtGui.QImage(buf, width, height, width * 3, QtGui.QImage.Format_RGB888).mirrored(False, True)
+  return imageToPNG(image)
@@ -0,0 +1,55 @@
+import SearchIndex
+
+# Inverted index from each trigram (3 consecutive characters of the folded texts) to the itemGroups containing it.
+# A query of 3 characters or more can only match the itemGroups containing all of its trigrams, so
+# intersecting a few posting lists replaces the scan of all the texts.
+# The posting lists are computed for the subtree of each top-level itemGroup and stored in it, so
+# they are computed once for the cached results (by the CacheLoader's worker threads, as they are
+# read), and only the top-level itemGroups of the uncached providers are indexed on each refresh.
+
+def trigrams(text):
+  return set(text[i:i+3] for i in range(len(text) - 2))
+
+# Posting lists of the subtree of a top-level itemGroup, with offsets relative to it in pre-order.
+def getPostings(group):
+  postings = group.get('trigrams')
+  if postings is None:
+    postings = {}
+    offset = 0
+    stack = [group]
+    while len(stack) > 0:
+      g = stack.pop()
+      for trigram in trigrams(SearchIndex.fold(g['text'])):
+        lst = postings.get(trigram)
+        if lst is None:
+          postings[trigram] = [offset]
+        else:
+          lst.append(offset)
+      offset += 1
+      stack.extend(reversed(g['subitems']))
+    group['trigrams'] = postings
+  return postings
+
+def indexItemGroups(itemGroups):
+  for group in itemGroups:
+    getPostings(group)
+
+# Indices in the SearchIndex of the itemGroups which may contain q (a folded query of 3 characters or more), in pre-order.
+def candidates(searchIndex, q):
+  queryTrigrams = trigrams(q)
+  result = []
+  for base, group in searchIndex.topLevel:
+    postings = getPostings(group)
+    lists = []
+    for trigram in queryTrigrams:
+      lst = postings.get(trigram)
+      if lst is None:
+        break
+      lists.append(lst)
+    else:
+      lists.sort(key = len)
+      if len(lists) == 1:
+        result.extend(base + offset for offset in lists[0])
+      else:
+        result.extend(sorted(base + offset for offset in set(lists[0]).intersection(*lists[1:])))
+  return result
@@ -0,0 +1,366 @@
+# Headless benchmarks of the cache, the search index and the results model, on synthetic trees of item groups.
+# Runs without FreeCAD, with the stand-ins of the stubs directory and the offscreen Qt platform
+# (PySide6 or PySide2 must be installed):
+#   python benchmarks/bench.py [--sizes 1000,10000,100000] [--json results.json] [--baseline baseline.json]
+# Write the results of a reference revision with --json, then run the benchmarks of a change with --baseline:
+# the metrics which regressed (and those which exceed the budgets below) are listed, and the exit status is 1.
+import argparse
+import gc
+import json
+import os
+import random
+import resource
+import shutil
+import sys
+import time
+import tracemalloc
+
+benchmarksDir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(benchmarksDir))
+sys.path.insert(0, os.path.join(benchmarksDir, 'stubs'))
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+
+from PySide import QtCore
+from PySide import QtGui
+import FreeCAD as App
+
+words = ['Part', 'Cube', 'Box', 'Sketch', 'Line', 'Pad', 'Pocket', 'Draft', 'Arch', 'Wall', 'Fillet', 'Chamfer', 'Mesh',
+         'Boolean', 'Cut', 'Fuse', 'Common', 'Extrude', 'Revolve', 'Loft', 'Sweep', 'Mirror', 'Array', 'Polar', 'Offset',
+         'Thickness', 'Constraint', 'Horizontal', 'Vertical', 'Datum', 'Plane', 'Shape', 'Binder', 'Export', 'Import']
+queries = ['f', 'fi', 'fil', 'fill', 'fille', 'fillet', 'fillet ch', 'zz', 'zzz']
+
+def randomText(rng):
+  return ' '.join(rng.choice(words) for i in range(rng.randint(1, 3))) + ' ' + str(rng.randint(0, 999))
+
+# A tree shaped like the toolbars of the workbenches: top-level groups of about 10 tools, about 10 subtools each
+# (trimmed to the requested size), with tooltips, workbenches, and icons which are mostly references to SVG files.
+def syntheticItemGroups(size, seed = 0):
+  import IconCache
+  rng = random.Random(seed)
+  pixelIcons = []
+  for i in range(16):
+    pixmap = QtGui.QPixmap(16, 16)
+    pixmap.fill(QtGui.QColor(i * 16, 255 - i * 16, 128))
+    pixelIcons.append(QtGui.QIcon(pixmap))
+  svgFiles = [os.path.join(os.path.dirname(benchmarksDir), name) for name in ['Tango-Tools-spanner-hammer.svg', 'Tango-System-search.svg']]
+  count = 0
+  def item(depth):
+    nonlocal count
+    count += 1
+    wb = rng.choice(words) + 'Workbench'
+    icon = rng.choice(pixelIcons) if rng.random() < 0.05 else IconCache.IconReference('file', rng.choice(svgFiles))
+    subitems = []
+    if depth < 2:
+      for i in range(rng.randint(5, 15)):
+        if count >= size:
+          break
+        subitems.append(item(depth + 1))
+    return {
+      'icon': icon,
+      'text': randomText(rng),
+      'toolTip': '<p>' + randomText(rng) + ' <b>' + randomText(rng) + '</b></p>',
+      'action': {'handler': 'tool', 'workbenches': [wb], 'toolbar': rng.choice(words), 'tool': rng.choice(words)},
+      'subitems': subitems,
+    }
+  itemGroups = []
+  while count < size:
+    itemGroups.append(item(0))
+  return itemGroups
+
+def countItems(itemGroups):
+  return sum(1 + countItems(g['subitems']) for g in itemGroups)
+
+def timed(f, repeat = 1):
+  best = None
+  for i in range(repeat):
+    gc.collect()
+    start = time.perf_counter()
+    result = f()
+    duration = time.perf_counter() - start
+    best = duration if best is None else min(best, duration)
+  return result, best * 1000
+
+# Peak of the memory allocated by Python while running f, in MB
+def peakMemory(f):
+  gc.collect()
+  tracemalloc.start()
+  try:
+    result = f()
+    current, peak = tracemalloc.get_traced_memory()
+  finally:
+    tracemalloc.stop()
+  return result, peak / 1e6
+
+# A shard with another format version, or truncated, must raise CacheFormatError and leave the file closed,
+# so that it can be rebuilt in place.
+def checkStaleShards(data, path):
+  import mmap
+  import struct
+  import Serialize
+  stale = bytearray(data)
+  struct.pack_into('<H', stale, 4, Serialize.cacheFormatVersion - 1)
+  for corrupted in [bytes(stale), data[:Serialize.headerFormat.size - 1], data[:len(data) // 2], data[:-1]]:
+    with open(path, 'wb') as f:
+      f.write(corrupted)
+    try:
+      Serialize.deserializeFile(path)
+      raise AssertionError('a stale or truncated shard was deserialized')
+    except Serialize.CacheFormatError as e:
+      traceback = e.__traceback__
+      while traceback is not None:
+        for value in list(traceback.tb_frame.f_locals.values()):
+          assert not isinstance(value, mmap.mmap) or value.closed, 'the shard is still mapped'
+        traceback = traceback.tb_next
+  with open(path, 'wb') as f:
+    f.write(data)
+
+# Subitems added in place below a top-level itemGroup which is returned again must be detected by GetItemGroups
+# (they need an id) and by the SearchIndex (it must not reuse the entries of that itemGroup).
+def checkSegments():
+  import GetItemGroups
+  import SearchIndex
+  def leaf(text):
+    return { 'icon': None, 'text': text, 'toolTip': '', 'action': { 'handler': 'tool' }, 'subitems': [] }
+  group = leaf('Group')
+  group['subitems'].append(leaf('First'))
+  try:
+    assert GetItemGroups.updateSegment('check', None, lambda: [group])
+    index = SearchIndex.SearchIndex([group])
+    assert not GetItemGroups.updateSegment('check', None, lambda: [group]), 'an unchanged segment was reported as changed'
+    group['subitems'].append(leaf('Second'))
+    assert GetItemGroups.updateSegment('check', None, lambda: [group]), 'subitems added in place were not detected'
+    assert all(subitem['id'] in GetItemGroups.globalGroups for subitem in group['subitems']), 'subitems added in place have no id'
+    index = SearchIndex.SearchIndex([group], index)
+    assert [g['text'] for g in index.groups] == ['Group', 'First', 'Second'], 'the SearchIndex reused a stale subtree'
+  finally:
+    GetItemGroups.segments.pop('check', None)
+
+def benchCache(itemGroups, results):
+  import Serialize
+  import RefreshTools
+  import SearchResults
+  data, results['serializeMs'] = timed(lambda: Serialize.serialize(itemGroups))
+  results['cacheBytes'] = len(data)
+  deserialized, results['deserializeMs'] = timed(lambda: Serialize.deserialize(data), 3)
+  path = os.path.join(App.getUserAppDataDir(), 'bench.cache')
+  with open(path, 'wb') as f:
+    f.write(data)
+  deserialized, results['deserializeFileMs'] = timed(lambda: Serialize.deserializeFile(path), 3)
+  checkStaleShards(data, path)
+  # The whole refresh, as done when FreeCAD starts: write the shards, then read them
+  SearchResults.resultProvidersCached.clear()
+  SearchResults.registerResultProvider('synthetic', getItemGroupsCached = lambda: itemGroups, getItemGroupsUncached = lambda: [])
+  written, results['writeCacheToolsMs'] = timed(lambda: RefreshTools.writeCacheTools())
+  read, results['readCacheToolsMs'] = timed(lambda: RefreshTools.readCacheTools(), 3)
+  return read
+
+def benchSearch(itemGroups, results):
+  import SearchIndex
+  import TrigramIndex
+  import FieldIndex
+  index, results['indexBuildMs'] = timed(lambda: SearchIndex.SearchIndex(itemGroups))
+  for group in itemGroups:
+    group.pop('trigrams', None)
+    group.pop('fields', None)
+  unused, results['trigramBuildMs'] = timed(lambda: TrigramIndex.indexItemGroups(itemGroups))
+  unused, results['fieldBuildMs'] = timed(lambda: FieldIndex.indexItemGroups(itemGroups))
+  index.useTrigrams = True
+  index.useFields = True
+  for mode in SearchIndex.matchModes:
+    # Each query on an empty cache: the cost of a query pasted in the search box
+    for query in queries:
+      def search():
+        index.cachedQueries.clear()
+        return SearchIndex.SearchJob(index, query, mode)
+      def firstPage():
+        job = search()
+        while not job.done:
+          job.step(None)
+        return job.rows.fetch(20)
+      unused, results['search/' + mode + '/' + query + 'Ms'] = timed(firstPage, 3)
+    # Typing a query one character at a time, each query narrowing the previous one
+    def typing():
+      index.cachedQueries.clear()
+      for i in range(1, len('fillet') + 1):
+        index.search('fillet'[:i], mode).fetch(20)
+    unused, results['typing/' + mode + 'Ms'] = timed(typing, 3)
+  return index
+
+def benchModel(index, results):
+  import ResultsModel
+  import SearchIndex
+  import IndentedItemDelegate
+  model = ResultsModel.ResultsModel(QtGui.QIcon(), 20)
+  view = QtGui.QListView()
+  view.setModel(model)
+  view.setItemDelegate(IndentedItemDelegate.IndentedItemDelegate())
+  view.resize(300, 400)
+  rows = index.search('')
+  unused, results['modelSetRowsMs'] = timed(lambda: model.setRows(index, rows), 3)
+  # Rendering the visible rows, which decodes their icons
+  unused, results['modelPaintMs'] = timed(lambda: view.grab(), 3)
+  # Paging through all the results, in at most 100 pages: with PySide6 6.12 on Python 3.11, each call of a void
+  # method such as beginInsertRows() decrements the reference count of None, the interpreter aborts after a few thousands.
+  view.setModel(None)
+  def fetchAll():
+    model.pageSize = max(20, len(rows) // 100)
+    model.setRows(index, rows)
+    while model.canFetchMore():
+      model.fetchMore()
+  unused, results['modelFetchAllMs'] = timed(fetchAll)
+  # Destroy the view while the QApplication still exists
+  del view
+  gc.collect()
+
+# Runs the event loop until condition() is true (or timeout seconds have passed),
+# returns the longest time during which the event loop was blocked, in ms.
+def runEventLoop(condition, timeout = 30.0):
+  loop = QtCore.QEventLoop()
+  timer = QtCore.QTimer()
+  timer.setInterval(5)
+  deadline = time.perf_counter() + timeout
+  last = time.perf_counter()
+  longest = 0.0
+  def tick():
+    nonlocal last, longest
+    now = time.perf_counter()
+    longest = max(longest, now - last)
+    last = now
+    if condition() or now > deadline:
+      loop.quit()
+  timer.timeout.connect(tick)
+  timer.start()
+  loop.exec()
+  timer.stop()
+  return longest * 1000
+
+# The whole path of a keystroke, as in FreeCAD: the SearchBox coalesces the keystrokes typed at about 10 per second,
+# the SearchScheduler runs the search in time slices, and the ResultsModel displays the first page.
+def benchSearchBox(itemGroups, results):
+  import GetItemGroups
+  import IndentedItemDelegate
+  import SearchBoxLight
+  def getItemGroups(restartStreams = True):
+    GetItemGroups.updateSegment('benchmark', None, lambda: itemGroups, immutable = True)
+    return GetItemGroups.segments['benchmark'][1]
+  sea = SearchBoxLight.SearchBoxLight(getItemGroups = getItemGroups,
+                                      getToolTip = lambda groupId, setParent: '',
+                                      getItemDelegate = lambda: IndentedItemDelegate.IndentedItemDelegate(),
+                                      getItemGroupsForQuery = lambda query, limit: [])
+  sea.proxyFilterModel('') # loads the actual implementation, there is no index yet
+  published = [] # (time, final, generation)
+  sea.searchScheduler.results.connect(lambda searchIndex, rows, final, generation: published.append((time.perf_counter(), final, generation)))
+  def finalResults(generation):
+    return lambda: any(final and g == generation for t, final, g in published)
+  # Focusing the search box: building the index and displaying all the results
+  start = time.perf_counter()
+  sea.refreshItemGroups()
+  runEventLoop(finalResults(sea.searchScheduler.generation))
+  results['searchBox/refreshMs'] = (published[-1][0] - start) * 1000
+  # Typing a query, on an empty cache of queries
+  sea.searchIndex.cachedQueries.clear()
+  longest = 0.0
+  for i in range(1, len('fillet') + 1):
+    keystroke = time.perf_counter()
+    sea.setText('fillet'[:i])
+    if i < len('fillet'):
+      longest = max(longest, runEventLoop(lambda: time.perf_counter() > keystroke + 0.1))
+  generation = sea.searchScheduler.generation
+  longest = max(longest, runEventLoop(finalResults(generation)))
+  times = [t for t, final, g in published if g == generation]
+  results['searchBox/firstResultsMs'] = (times[0] - keystroke) * 1000
+  results['searchBox/finalResultsMs'] = (times[-1] - keystroke) * 1000
+  results['searchBox/longestBlockedMs'] = longest
+  assert sea.mdl.rowCount() > 0, 'no results were displayed for the query'
+  # The ancestors of the matches are displayed above them
+  assert any('fillet' in sea.mdl.data(sea.mdl.index(row, 0)).lower() for row in range(sea.mdl.nbRows)), 'no displayed result matches the query'
+  GetItemGroups.segments.pop('benchmark', None)
+  sea.deleteLater()
+  del sea
+  gc.collect()
+
+def benchMemory(itemGroups, results):
+  import Serialize
+  import SearchIndex
+  import TrigramIndex
+  import FieldIndex
+  data = Serialize.serialize(itemGroups)
+  deserialized, results['deserializePeakMB'] = peakMemory(lambda: Serialize.deserialize(data))
+  def buildIndexes():
+    index = SearchIndex.SearchIndex(deserialized)
+    TrigramIndex.indexItemGroups(deserialized)
+    FieldIndex.indexItemGroups(deserialized)
+    return index
+  unused, results['indexPeakMB'] = peakMemory(buildIndexes)
+
+# Limits which hold on any machine, whatever the baseline: typing must never block the event loop for long.
+budgets = {
+  'searchBox/longestBlockedMs': 100,
+}
+
+# Returns the descriptions of the metrics which exceed their budget, or which regressed compared to the results
+# of the same size in baseline (a list of results, as written by --json): slower by more than the tolerance factor
+# and by more than minDelta ms (or MB), to ignore the noise of the fastest measurements.
+def regressions(allResults, baseline, tolerance, minDelta):
+  found = []
+  baselineBySize = { results['size']: results for results in baseline or [] }
+  for results in allResults:
+    for key, value in results.items():
+      if key in budgets and value > budgets[key]:
+        found.append(str(results['size']) + ' items: ' + key + ' = ' + ('%.2f' % value) + ', budget ' + str(budgets[key]))
+      reference = baselineBySize.get(results['size'], {}).get(key)
+      if (key.endswith('Ms') or key.endswith('MB')) and isinstance(reference, (int, float)) \
+         and value > reference * tolerance and value - reference > minDelta:
+        found.append(str(results['size']) + ' items: ' + key + ' = ' + ('%.2f' % value) + ', baseline ' + ('%.2f' % reference))
+  return found
+
+# The memory is measured separately, tracemalloc slows down the code it traces.
+def bench(size):
+  results = { 'size': size }
+  itemGroups, results['generateMs'] = timed(lambda: syntheticItemGroups(size))
+  results['items'] = countItems(itemGroups)
+  itemGroups = benchCache(itemGroups, results)
+  index = benchSearch(itemGroups, results)
+  benchModel(index, results)
+  benchSearchBox(itemGroups, results)
+  benchMemory(itemGroups, results)
+  results['maxRssMB'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1e3
+  return results
+
+def main():
+  parser = argparse.ArgumentParser(description = 'Benchmarks of the SearchBar cache, search index and results model.')
+  parser.add_argument('--sizes', default = '1000,10000,100000', help = 'comma-separated numbers of items')
+  parser.add_argument('--json', help = 'write the results to this file')
+  parser.add_argument('--baseline', help = 'compare the results with those of this file (written by --json), exit with status 1 if they regressed')
+  parser.add_argument('--tolerance', type = float, default = 1.5, help = 'factor by which a metric may exceed the baseline')
+  parser.add_argument('--min-delta', type = float, default = 5.0, help = 'difference with the baseline (in ms or MB) below which a metric is not a regression')
+  args = parser.parse_args()
+  baseline = None
+  if args.baseline:
+    with open(args.baseline, 'r') as f:
+      baseline = json.load(f)
+  app = QtGui.QApplication.instance() or QtGui.QApplication(sys.argv)
+  shutil.rmtree(App.userAppDataDir, ignore_errors = True)
+  os.makedirs(App.userAppDataDir)
+  checkSegments()
+  allResults = []
+  try:
+    for size in [int(size) for size in args.sizes.split(',')]:
+      results = bench(size)
+      allResults.append(results)
+      print('--- ' + str(results['items']) + ' items')
+      for key, value in results.items():
+        print('  ' + key.ljust(36) + (('%.2f' % value) if isinstance(value, float) else str(value)))
+  finally:
+    shutil.rmtree(App.userAppDataDir, ignore_errors = True)
+  if args.json:
+    with open(args.json, 'w') as f:
+      json.dump(allResults, f, indent = 2)
+  found = regressions(allResults, baseline, args.tolerance, args.min_delta)
+  for regression in found:
+    print('REGRESSION ' + regression)
+  if len(found) > 0:
+    sys.exit(1)
+
+if __name__ == '__main__':
+  main()
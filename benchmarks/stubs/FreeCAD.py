@@ -0,0 +1,26 @@
+# Stand-in for the FreeCAD module, with just enough of its API for the benchmarks.
+# Parameters always have their default value, the user data directory is set by the benchmark.
+import os
+import tempfile
+
+userAppDataDir = os.path.join(tempfile.gettempdir(), 'SearchBarBenchmarks')
+
+class ParameterGrp():
+  def GetBool(self, name, default = False): return default
+  def GetInt(self, name, default = 0): return default
+  def GetUnsigned(self, name, default = 0): return default
+  def GetFloat(self, name, default = 0.0): return default
+  def GetString(self, name, default = ''): return default
+  def GetContents(self): return None
+
+def ParamGet(path):
+  return ParameterGrp()
+
+def getUserAppDataDir():
+  return userAppDataDir
+
+def ConfigGet(name):
+  return ''
+
+def Version():
+  return ['0', '21', '0', 'benchmark']
@@ -0,0 +1,14 @@
+# Stand-in for the FreeCADGui module, with just enough of its API for the benchmarks.
+def listWorkbenches():
+  return {}
+
+def getMainWindow():
+  return None
+
+def updateGui():
+  from PySide import QtGui
+  QtGui.QApplication.processEvents()
+
+def getIcon(name):
+  from PySide import QtGui
+  return QtGui.QIcon(name)
@@ -0,0 +1,4 @@
+try:
+  from PySide6.QtCore import *
+except ImportError:
+  from PySide2.QtCore import *
@@ -0,0 +1,8 @@
+try:
+  from PySide6.QtGui import *
+  from PySide6.QtWidgets import *
+  from PySide6.QtCore import Qt
+except ImportError:
+  from PySide2.QtGui import *
+  from PySide2.QtWidgets import *
+  from PySide2.QtCore import Qt
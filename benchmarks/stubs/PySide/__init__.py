@@ -0,0 +1,2 @@
+# Stand-in for the PySide compatibility module shipped with FreeCAD, which maps PySide to PySide6 or PySide2
+# and exposes the widgets in QtGui, as Qt 4 did.